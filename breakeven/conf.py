@@ -20,6 +20,14 @@ from pydantic import BaseSettings
 class Settings(BaseSettings):
     DB_CONFIG: str
     BREAKEVEN_SERVICE_URL: str
+    # Request tracing (services.tracing); TRACE_EXPORT_FILE appends finished spans as JSON lines
+    TRACING_ENABLED: bool = True
+    TRACE_MAX_TRACES: int = 500
+    TRACE_MAX_SPANS_PER_TRACE: int = 2000
+    TRACE_EXPORT_FILE: str = ""
+    # Response compression (services.compression); internal hops favour speed, 0 turns it off
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_LEVEL: int = 1
 
     class Config:
         # The environment file to load configuration from
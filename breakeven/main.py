@@ -14,6 +14,9 @@ load_dotenv()  # Load environment variables *before* anything else
 
 from routers import break_even
 from routers import implied_volatility
+from routers import traces
+from services.compression import CompressionMiddleware
+from services.tracing import TracingMiddleware
 # from routers import safestrike
 
 app = FastAPI()
@@ -25,6 +28,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(TracingMiddleware, service="breakeven", exclude=("/api/v1_0/traces",))
 
 try:
     register_tortoise(
@@ -45,4 +50,5 @@ except Exception as e:
 
 app.include_router(break_even.router)
 app.include_router(implied_volatility.router)
+app.include_router(traces.router)
 # app.include_router(safestrike.router)
\ No newline at end of file
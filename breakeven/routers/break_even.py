@@ -3,6 +3,8 @@ from datetime import datetime, timedelta, date
 from collections import defaultdict, deque
 from pydantic import BaseModel, Field , ValidationError
 from services.utils import execute_native_query
+from services.tracing import client_trace_config
+from services.fast_json import fast_json
 import logging
 from typing import List, Dict, Any, Optional
 import numpy as np
@@ -328,6 +330,7 @@ def analyze_strategy_numerically(legs):
 
 # New API endpoint specifically for numerical analysis
 @router.post("/api/v1_0/analyze_custom_strategy", status_code=status.HTTP_200_OK, response_model=Dict)
+@fast_json
 async def analyze_custom_strategy(
     request: Request,
     strategy_request: StrategyRequest,
@@ -384,7 +387,8 @@ async def analyze_custom_strategy(
         year = today.year
 
         # Create an HTTP client session for making requests
-        async with aiohttp.ClientSession() as session:
+        # propagate=True: the nse spans of these price lookups join this request's trace
+        async with aiohttp.ClientSession(trace_configs=[client_trace_config(propagate=True)]) as session:
             # Process each leg to fetch current price if not provided
             for leg in strategy_request.legs:
                 # Create a copy of the leg
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, status
+
+from auth import decode_access_token, is_admin_user
+from services.tracing import collector, summarize
+
+
+def require_admin(authorization: str = Header(None)):
+    """Spans carry other users' requests and SQL: admin tokens only (the gateway passes the caller's on)."""
+    try:
+        payload = decode_access_token(authorization)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e), headers={"WWW-Authenticate": "Bearer"}
+        )
+    if not is_admin_user(payload):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="You are not allowed to access this scope.")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/api/v1_0/traces", status_code=status.HTTP_200_OK)
+async def recent_traces(limit: int = 50):
+    """Latest traced requests of this instance, newest first."""
+    return {"service": collector.service, "requests": collector.recent(min(limit, 500))}
+
+
+@router.get("/api/v1_0/traces/{trace_id}", status_code=status.HTTP_200_OK)
+async def trace_detail(trace_id: str):
+    """Spans this instance recorded for one trace, with their summary."""
+    trace = collector.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Trace not found or evicted")
+    return {**trace, "summary": summarize(trace["spans"])}
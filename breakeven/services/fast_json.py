@@ -0,0 +1,97 @@
+"""
+Fast JSON responses for the large payloads (simulation days, raw DB rows).
+
+FastAPI runs whatever an endpoint returns through jsonable_encoder, which
+rebuilds the whole payload in Python before json.dumps walks it again.
+Endpoints decorated with @fast_json return a FastJSONResponse instead, which
+writes the payload to bytes in one pass: dicts, lists, dataclasses, pydantic
+models, numpy values, datetimes and Decimals. orjson does the work when it is
+installed, the standard library otherwise. orjson writes NaN/inf as null;
+the fallback rejects them, like JSONResponse.
+"""
+import dataclasses
+import datetime
+import functools
+import json
+from decimal import Decimal
+from enum import Enum
+from uuid import UUID
+
+import numpy as np
+from fastapi import Response, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # optional, see requirements.txt
+    orjson = None
+
+
+def _default(value):
+    """What neither encoder handles natively, converted the way jsonable_encoder does."""
+    if isinstance(value, BaseModel):
+        return value.dict()
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return dataclasses.asdict(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps(content) -> bytes:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(content) -> bytes:
+        return json.dumps(
+            content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def fast_json(endpoint):
+    """
+    Return the endpoint's result as a FastJSONResponse, keeping the status
+    code and headers it set on its `response` parameter. Place it below the
+    router decorator. The undecorated endpoint stays reachable as
+    endpoint.__wrapped__ for callers that want the plain result.
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        result = await endpoint(*args, **kwargs)
+        if isinstance(result, Response):
+            return result
+        sub_response = kwargs.get("response")
+        fast_response = FastJSONResponse(
+            result,
+            status_code=getattr(sub_response, "status_code", None) or status.HTTP_200_OK,
+        )
+        if sub_response is not None:
+            fast_response.raw_headers.extend(
+                (name, value) for name, value in sub_response.raw_headers
+                if name not in (b"content-length", b"content-type")
+            )
+        return fast_response
+
+    return wrapper
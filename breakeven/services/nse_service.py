@@ -3,6 +3,8 @@ import logging
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 
+from services.tracing import client_trace_config, span
+
 logger = logging.getLogger(__name__)
 
 class NSE:
@@ -28,13 +30,27 @@ class NSE:
     async def _create_session(self):
         """Create aiohttp session if not exists"""
         if self.session is None:
-            self.session = aiohttp.ClientSession(headers=self.headers)
+            self.session = aiohttp.ClientSession(headers=self.headers, trace_configs=[client_trace_config()])
 
-    async def get_historical_data(self, symbol: str, from_date: datetime, to_date: datetime, 
-                                expiry_date: datetime, option_type: str, strike_price: float) -> List[Dict[str, Any]]:
+    async def get_historical_data(self, symbol: str, from_date: datetime, to_date: datetime,
+                                  expiry_date: datetime, option_type: str, strike_price: float) -> List[Dict[str, Any]]:
         """
         Fetch historical options data from NSE
         """
+        with span("nse.historical_data", "http", symbol=symbol, option_type=option_type,
+                  strike_price=strike_price) as current:
+            result = await self._fetch_historical_data(
+                symbol, from_date, to_date, expiry_date, option_type, strike_price
+            )
+            if current is not None:
+                current.attributes["rows"] = len(result)
+            return result
+
+    async def _fetch_historical_data(self, symbol: str, from_date: datetime, to_date: datetime,
+                                     expiry_date: datetime, option_type: str, strike_price: float) -> List[Dict[str, Any]]:
+        """
+        Session warm-up (homepage, option chain) and the historical data call
+        """
         try:
             # Ensure session is created
             await self._create_session()
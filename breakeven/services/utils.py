@@ -3,6 +3,8 @@ from tortoise.transactions import in_transaction
 import logging
 from fastapi import HTTPException
 
+from services.tracing import span, statement_summary
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,8 +13,11 @@ async def execute_native_query(query: str , params: None):
 
     connection = Tortoise.get_connection('default')
 
-    async with in_transaction():
-        results = await connection.execute_query_dict(query, params)
+    with span("db.query", "db") as current:
+        async with in_transaction():
+            results = await connection.execute_query_dict(query, params)
+        if current is not None:
+            current.attributes.update(statement=statement_summary(query), rows=len(results))
     return results    
 
 
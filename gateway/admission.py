@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import math
+import time
+
+from collections import deque
+from typing import Dict, Optional
+
+from fastapi import HTTPException, status
+
+from conf import settings
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+
+def parse_rate(rate_limit: str):
+    """'10/minute' -> (capacity 10, 10 / 60 tokens per second)."""
+    count, _, period = rate_limit.partition('/')
+    seconds = PERIODS.get(period.strip().rstrip('s'))
+    if not count.strip().isdigit() or seconds is None or int(count) < 1:
+        raise ValueError(f'Invalid rate limit {rate_limit!r}, expected e.g. "10/minute"')
+    return int(count), int(count) / seconds
+
+
+def too_many_requests(retry_after: float, detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={'Retry-After': str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class RateLimiter:
+    """
+    Token buckets of one route, one per user: `capacity` requests at once,
+    refilled at `rate` tokens per second. A request that finds the bucket
+    empty reserves the next token and waits for it, unless that wait is
+    longer than the admission deadline.
+    """
+
+    def __init__(self, rate_limit: str):
+        self.capacity, self.rate = parse_rate(rate_limit)
+        self._buckets: Dict[str, list] = {}  # user -> [tokens, updated at]
+
+    def _prune(self, now: float):
+        # a bucket that has refilled completely is the same as no bucket
+        full_after = self.capacity / self.rate
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items()
+            if now - bucket[1] < full_after
+        }
+
+    def reserve(self, key: str, max_wait: float) -> float:
+        """Take a token for key; returns the seconds to wait for it, or raises 429."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= settings.RATE_LIMIT_MAX_BUCKETS:
+                self._prune(now)
+            bucket = self._buckets[key] = [float(self.capacity), now]
+        tokens = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+        if wait > max_wait:
+            bucket[0], bucket[1] = tokens, now
+            raise too_many_requests(wait, 'Rate limit exceeded, slow down.')
+        bucket[0], bucket[1] = tokens - 1, now
+        return wait
+
+
+class ConcurrencyLimiter:
+    """At most `limit` admitted requests to one upstream at a time; the rest wait in FIFO order."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    async def acquire(self, timeout: float) -> bool:
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # shielded so a timeout cannot lose a slot handed over at the same moment
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # the slot goes straight to the next waiter, active stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> dict:
+        return {'limit': self.limit, 'active': self.active, 'waiting': self.waiting}
+
+
+_concurrency_limiters: Dict[str, ConcurrencyLimiter] = {}
+
+
+def concurrency_limiter_for(service_url: str) -> ConcurrencyLimiter:
+    """The limiter shared by every concurrency-limited route of one upstream."""
+    limiter = _concurrency_limiters.get(service_url)
+    if limiter is None:
+        limiter = _concurrency_limiters[service_url] = ConcurrencyLimiter(settings.UPSTREAM_MAX_CONCURRENCY)
+    return limiter
+
+
+def concurrency_stats() -> Dict[str, dict]:
+    return {service_url: limiter.stats() for service_url, limiter in _concurrency_limiters.items()}
+
+
+@contextlib.asynccontextmanager
+async def admit(user_key: str, rate_limiter: Optional[RateLimiter], concurrency: Optional[ConcurrencyLimiter]):
+    """
+    Admission control around one upstream call. Waiting for a token and for a
+    concurrency slot share one ADMISSION_QUEUE_TIMEOUT_SECONDS deadline;
+    past it the request is refused with 429 and Retry-After.
+    """
+    deadline = time.monotonic() + settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+    if rate_limiter is not None:
+        wait = rate_limiter.reserve(user_key, settings.ADMISSION_QUEUE_TIMEOUT_SECONDS)
+        if wait > 0:
+            await asyncio.sleep(wait)
+    if concurrency is None:
+        yield
+        return
+    if not await concurrency.acquire(max(0.0, deadline - time.monotonic())):
+        raise too_many_requests(
+            settings.ADMISSION_QUEUE_TIMEOUT_SECONDS, 'Service is busy, try again shortly.'
+        )
+    try:
+        yield
+    finally:
+        concurrency.release()
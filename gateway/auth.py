@@ -1,5 +1,8 @@
+import hashlib
 import jwt
+import time
 
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
 from conf import settings
@@ -46,17 +49,77 @@ def generate_access_token(
 #     return encoded_jwt
     
 
+class DecodedTokenCache:
+    """
+    Bounded LRU of sha256(token) -> (decoded payload, exp timestamp).
+
+    Only tokens that passed signature verification are stored, so a hit can
+    skip jwt.decode entirely; exp is still checked on every lookup.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        payload, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def put(self, key: str, payload: dict):
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (payload, payload.get('exp'))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+token_cache = DecodedTokenCache(settings.JWT_CACHE_SIZE)
+
+
 def decode_access_token(authorization: str = None):
     if not authorization:
         raise AuthTokenMissing('Auth token is missing in headers.')
     token = authorization.replace('Bearer ', '')
+    cache_key = token_cache.key(token)
+    payload = token_cache.get(cache_key)
+    if payload is not None:
+        # callers get their own copy, the cached payload must stay untouched
+        return dict(payload)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=ALGORITHM)
-        return payload
     except jwt.exceptions.ExpiredSignatureError:
         raise AuthTokenExpired('Auth token is expired.')
     except jwt.exceptions.DecodeError:
         raise AuthTokenCorrupted('Auth token is corrupted.')
+    token_cache.put(cache_key, payload)
+    return dict(payload)
 
 
 def generate_request_header(token_payload):
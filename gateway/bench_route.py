@@ -0,0 +1,120 @@
+"""
+Microbenchmark for the pure gateway overhead of core.route.
+
+The upstream call is replaced by an in-process stub, so the numbers cover
+token decoding, authorization, header generation, payload handling and
+FastAPI dispatch, but no network. Run from the gateway directory:
+
+    python bench_route.py                 # 2000 requests per scenario
+    python bench_route.py -n 10000 --stream
+"""
+import argparse
+import statistics
+import time
+
+from fastapi import FastAPI, Request, Response, status
+from fastapi.testclient import TestClient
+
+import core
+from auth import generate_access_token
+
+SERVICE_URL = 'http://upstream.invalid'
+
+
+async def fake_make_request(service_url, path, method, data=None, headers=None, sticky_key=None):
+    return {'ok': True}, 200
+
+
+class FakeUpstream:
+    status = 200
+    headers = {'content-type': 'application/json'}
+
+
+async def fake_stream_request(service_url, path, method, data=None, headers=None, sticky_key=None):
+    return FakeUpstream()
+
+
+async def fake_iter_body(upstream):
+    yield b'{"ok": true}'
+
+
+def build_app(stream: bool) -> FastAPI:
+    app = FastAPI()
+
+    @core.route(
+        request_method=app.get,
+        path='/bench/public',
+        status_code=status.HTTP_200_OK,
+        payload_key=None,
+        service_url=SERVICE_URL,
+        authentication_required=False,
+        # a post processor keeps the buffered path unless streaming is benchmarked
+        post_processing_func=None if stream else 'bench_route.identity',
+    )
+    async def public(request: Request, response: Response):
+        pass
+
+    @core.route(
+        request_method=app.get,
+        path='/bench/private',
+        status_code=status.HTTP_200_OK,
+        payload_key=None,
+        service_url=SERVICE_URL,
+        authentication_required=True,
+        service_authorization_checker='auth.is_default_user',
+        post_processing_func=None if stream else 'bench_route.identity',
+    )
+    async def private(request: Request, response: Response):
+        pass
+
+    return app
+
+
+def identity(data):
+    return data
+
+
+def run(client: TestClient, url: str, headers: dict, requests: int, warmup: int):
+    for _ in range(warmup):
+        client.get(url, headers=headers)
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        resp = client.get(url, headers=headers)
+        timings.append((time.perf_counter() - started) * 1e6)
+        assert resp.status_code == 200, resp.text
+    timings.sort()
+    return {
+        'mean': statistics.mean(timings),
+        'p50': timings[len(timings) // 2],
+        'p99': timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure core.route overhead per request')
+    parser.add_argument('-n', '--requests', type=int, default=2000, help='timed requests per scenario')
+    parser.add_argument('--warmup', type=int, default=200, help='untimed requests per scenario')
+    parser.add_argument('--stream', action='store_true', help='benchmark the streaming pass-through path')
+    args = parser.parse_args()
+
+    core.make_request = fake_make_request
+    core.stream_request = fake_stream_request
+    core.iter_body = fake_iter_body
+    core.forwardable_headers = lambda upstream: dict(upstream.headers)
+
+    client = TestClient(build_app(args.stream))
+    token = generate_access_token({'user_id': 1, 'user_type': 'default'})
+    scenarios = [
+        ('public', '/bench/public', {}),
+        ('authenticated', '/bench/private', {'authorization': f'Bearer {token}'}),
+    ]
+
+    print(f'{"scenario":<15}{"mean us":>10}{"p50 us":>10}{"p99 us":>10}')
+    for name, url, headers in scenarios:
+        result = run(client, url, headers, args.requests, args.warmup)
+        print(f'{name:<15}{result["mean"]:>10.1f}{result["p50"]:>10.1f}{result["p99"]:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
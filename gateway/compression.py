@@ -0,0 +1,119 @@
+"""
+gzip/deflate compression of responses, negotiated from Accept-Encoding.
+
+Bodies of compressible types (JSON, text) of at least COMPRESSION_MIN_SIZE
+bytes are compressed at COMPRESSION_LEVEL; streamed bodies are compressed
+chunk by chunk. Responses that already carry a Content-Encoding (e.g. a
+body proxied as it came) are left alone. A COMPRESSION_LEVEL of 0 turns
+compression off.
+"""
+import zlib
+from typing import Optional
+
+from conf import settings
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/javascript", b"application/xml")
+
+# zlib wbits of each content coding: gzip framing, or the zlib format HTTP calls deflate
+WBITS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+
+def negotiate(accept_encoding: str) -> Optional[str]:
+    """The coding to use for an Accept-Encoding header: gzip, deflate or None."""
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in ("gzip", "deflate"):
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or settings.COMPRESSION_LEVEL <= 0:
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        coding = negotiate(accept_encoding) if accept_encoding else None
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(send, coding).send)
+
+
+class _CompressingSender:
+    """Holds back the response start until the first body chunk shows whether to compress."""
+
+    def __init__(self, send, coding: str):
+        self._send = send
+        self.coding = coding
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if self.passthrough:
+            await self._send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            headers = dict(message.get("headers", []))
+            content_type = headers.get(b"content-type", b"")
+            if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                self.passthrough = True
+                await self._send(message)
+            else:
+                self.start = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            if not more_body and len(body) < settings.COMPRESSION_MIN_SIZE:
+                self.passthrough = True
+                await self._send(self._start_headers(compressed=False))
+                await self._send(message)
+                return
+            self.compressor = zlib.compressobj(settings.COMPRESSION_LEVEL, zlib.DEFLATED, WBITS[self.coding])
+            if not more_body:
+                body = self.compressor.compress(body) + self.compressor.flush()
+                await self._send(self._start_headers(compressed=True, length=len(body)))
+                await self._send({"type": "http.response.body", "body": body})
+                return
+            await self._send(self._start_headers(compressed=True))
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.flush()
+        if chunk or not more_body:
+            await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    def _start_headers(self, compressed: bool, length: Optional[int] = None) -> dict:
+        headers = [
+            (name, value) for name, value in self.start.get("headers", [])
+            if not (compressed and name == b"content-length")
+        ]
+        headers.append((b"vary", b"Accept-Encoding"))
+        if compressed:
+            headers.append((b"content-encoding", self.coding.encode()))
+            if length is not None:
+                headers.append((b"content-length", str(length).encode()))
+        return {**self.start, "headers": headers}
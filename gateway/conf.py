@@ -5,11 +5,51 @@ from pydantic import BaseSettings
 class Settings(BaseSettings):
     AUTH0_DOMAIN: str = os.getenv("AUTH0_DOMAIN")   
     ACCESS_TOKEN_DEFAULT_EXPIRES_MINUTES: int = 360
+    # Verified JWT payloads kept in memory (auth.token_cache), 0 disables it
+    JWT_CACHE_SIZE: int = 1024
+    # Service urls may list several replicas: "http://nse-1:8000,http://nse-2:8000"
     NSE_SERVICE_URL : str = os.getenv("NSE_SERVICE_URL")
     #NSE_SERVICE_URL: str = os.environ.get("NSE_SERVICE_URL") # if above doesnot work use this
     USER_SERVICE_URL : str = os.getenv("USER_SERVICE_URL")
     BREAKEVEN_SERVICE_URL : str = os.getenv("BREAKEVEN_SERVICE_URL")
     GATEWAY_TIMEOUT: int = 120
+    # Pooled upstream connections (network.upstream_pool)
+    UPSTREAM_POOL_LIMIT: int = 100
+    UPSTREAM_POOL_LIMIT_PER_HOST: int = 50
+    UPSTREAM_KEEPALIVE_SECONDS: int = 30
+    UPSTREAM_DNS_CACHE_SECONDS: int = 300
+    # Per-attempt upstream limits; GATEWAY_TIMEOUT still bounds a whole call
+    UPSTREAM_CONNECT_TIMEOUT: float = 5
+    UPSTREAM_READ_TIMEOUT: float = 120
+    # Retries of idempotent requests on connection errors, timeouts and 502/504
+    UPSTREAM_RETRIES: int = 2
+    UPSTREAM_RETRY_BACKOFF_SECONDS: float = 0.2
+    # Per-upstream circuit breaker (network.CircuitBreaker)
+    BREAKER_FAILURE_THRESHOLD: int = 5
+    BREAKER_RESET_SECONDS: float = 30
+    BREAKER_HALF_OPEN_PROBES: int = 1
+    # Response cache of route(cache_ttl=...); set RESPONSE_CACHE_DB_PATH to an
+    # sqlite file to share entries between the workers of a host
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1024
+    RESPONSE_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    RESPONSE_CACHE_DB_PATH: str = os.getenv("RESPONSE_CACHE_DB_PATH", "")
+    # Admission control: route(rate_limit=..., limit_concurrency=True)
+    UPSTREAM_MAX_CONCURRENCY: int = 8
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = 5
+    RATE_LIMIT_MAX_BUCKETS: int = 10000
+    # Sub-requests accepted by one /api/v1_0/batch call
+    BATCH_MAX_REQUESTS: int = 20
+    # Request tracing (tracing.py); TRACE_EXPORT_FILE appends finished spans as JSON lines
+    TRACING_ENABLED: bool = True
+    TRACE_MAX_TRACES: int = 500
+    TRACE_MAX_SPANS_PER_TRACE: int = 2000
+    TRACE_EXPORT_FILE: str = os.getenv("TRACE_EXPORT_FILE", "")
+    # gzip/deflate of answers to clients (compression.py), 0 turns it off; bodies
+    # streamed from a service keep the encoding the service chose
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_LEVEL: int = 6
+    # DEBUG logs every proxied request with its upstream status and latency
+    GATEWAY_LOG_LEVEL: str = "INFO"
 
 
 settings = Settings()    
\ No newline at end of file
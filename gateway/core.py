@@ -1,13 +1,25 @@
 import aiohttp
+import asyncio
+import copy
 import functools
+import logging
+import time
 
 
 from importlib import import_module
 from fastapi import Request, Response, HTTPException, status
-from typing import List
+from typing import Callable, List, Optional, Tuple
 
-from exceptions import (AuthTokenMissing, AuthTokenExpired, AuthTokenCorrupted)
-from network import make_request
+from fastapi.responses import StreamingResponse
+from starlette.routing import compile_path
+
+from admission import ConcurrencyLimiter, RateLimiter, admit, concurrency_limiter_for
+from metrics import gateway_metrics
+from network import CircuitOpenError, make_request, stream_request, forwardable_headers, iter_body
+from response_cache import CachedResponse, render_json, response_cache
+from singleflight import upstream_flights
+
+logger = logging.getLogger(__name__)
 
 
 def route(
@@ -19,7 +31,13 @@ def route(
         service_authorization_checker: str = 'auth.is_admin_user',
         service_header_generator: str = 'auth.generate_request_header',
         response_model: str = None,
-        response_list: bool = False
+        response_list: bool = False,
+        coalesce: bool = False,
+        cache_ttl: int = 0,
+        cache_key: str = None,
+        sticky: bool = False,
+        rate_limit: str = None,
+        limit_concurrency: bool = False
 ):
     
     """
@@ -38,6 +56,21 @@ def route(
         service_header_generator: generates headers for inner services from jwt token payload # noqa
         response_model: shows return type and details on api docs
         response_list: decides whether response structure is list or not
+        coalesce: identical concurrent GETs (same url and service headers, so
+            the same user on authenticated routes) share one upstream call
+        cache_ttl: seconds a successful GET response is served from the
+            gateway response cache (0 disables caching)
+        cache_key: builds the cache key from (request, service_headers),
+            defaults to the path, query and service headers of the request
+        sticky: keeps a user's requests on the same replica of service_url
+            (a comma-separated replica list) while that replica is healthy
+        rate_limit: per-user token bucket for the route, e.g. '5/minute'
+        limit_concurrency: counts the route's calls against the shared
+            UPSTREAM_MAX_CONCURRENCY cap of service_url (for expensive routes)
+
+    Routes with neither post_processing_func nor response_model are proxied
+    in streaming mode: upstream status, headers and body chunks are passed
+    through as they arrive instead of being decoded and re-serialised.
 
     Returns:
         wrapped endpoint result as is
@@ -46,115 +79,386 @@ def route(
 
     # request_method: app.post || app.get or so on
     # app_any: app.post('/api/login', status_code=200, response_model=int)
+    # Everything that can be resolved is resolved here, once, so a typo in a
+    # dotted path fails at startup instead of silently on every request.
     if response_model:
-        response_model = import_function(response_model)
+        response_model = resolve_function(response_model)
         if response_list:
             response_model = List[response_model]
 
+    proxy = ProxyRoute(
+        method=request_method.__name__,
+        path=path,
+        status_code=status_code,
+        service_url=service_url,
+        auth=RouteAuth(
+            authentication_required,
+            authentication_token_decoder,
+            service_authorization_checker,
+            service_header_generator,
+        ),
+        post_processor=resolve_function(post_processing_func) if post_processing_func else None,
+        coalesce=coalesce,
+        cache_ttl=cache_ttl,
+        make_cache_key=resolve_function(cache_key) if cache_key else default_cache_key,
+        sticky=sticky,
+        rate_limiter=RateLimiter(rate_limit) if rate_limit else None,
+        concurrency=concurrency_limiter_for(service_url) if limit_concurrency else None,
+    )
+    route_registry.append(proxy)
 
+    # nothing needs the decoded body, so it can be passed through untouched;
+    # coalesced and cached responses are reused, so those are buffered
+    stream_response = not (post_processing_func or response_model or coalesce or cache_ttl)
 
     app_any = request_method(
         path, status_code=status_code,
         response_model=response_model
     )
 
-    def wrapper(f):
-        @app_any
-        @functools.wraps(f)
-        async def inner(request: Request, response: Response, **kwargs):
-            service_headers = {}
-            if authentication_required:
-                # authentication
-                authorization = request.headers.get('authorization')
-                token_decoder = import_function(authentication_token_decoder)
-                exc = None
+    route_metrics = gateway_metrics.route(proxy.method, path)
+
+    async def handle(request: Request, response: Response, kwargs: dict, started: float):
+        service_headers = proxy.auth(request)
+        phase_started = route_metrics.observe('auth', started)
+
+        scope = request.scope
+        method = scope['method'].lower()
+        request_path = scope['path']
+
+        payload_obj = kwargs.get(payload_key) if payload_key else None
+        payload = payload_obj.dict() if payload_obj else {}
+
+        entry_key, cached = proxy.cached(request, service_headers)
+        if cached is not None:
+            return _cached_response(request, cached, 'HIT')
+
+        async with proxy.admit(proxy.user_key(request, service_headers)):
+            phase_started = route_metrics.observe('admission', phase_started)
+            if stream_response:
                 try:
-                    token_payload = token_decoder(authorization)
-                except (AuthTokenMissing,
-                        AuthTokenExpired,
-                        AuthTokenCorrupted) as e:
-                    exc = str(e)
-                except Exception as e:
-                    # in case a new decoder is used by dependency injection and
-                    # there might be an unexpected error
-                    exc = str(e)
-                finally:
-                    if exc:
-                        raise HTTPException(
-                            status_code=status.HTTP_401_UNAUTHORIZED,
-                            detail=exc,
-                            headers={'WWW-Authenticate': 'Bearer'},
-                        )
-
-                # authorization
-                if service_authorization_checker:
-                    authorization_checker = import_function(
-                        service_authorization_checker
+                    upstream = await stream_request(
+                        service_url=service_url,
+                        path=request_path,
+                        method=method,
+                        data=payload,
+                        # the service compresses for the client; the body is passed on as is
+                        headers={
+                            **service_headers,
+                            'Accept-Encoding': request.headers.get('accept-encoding', 'identity'),
+                        },
+                        sticky_key=proxy.sticky_key(service_headers),
                     )
-                    is_user_eligible = authorization_checker(token_payload)
-                    if not is_user_eligible:
-                        raise HTTPException(
-                            status_code=status.HTTP_403_FORBIDDEN,
-                            detail='You are not allowed to access this scope.',
-                            headers={'WWW-Authenticate': 'Bearer'},
-                        )
-
-                # service headers
-                if service_header_generator:
-                    header_generator = import_function(
-                        service_header_generator
+                except UPSTREAM_ERRORS as e:
+                    raise upstream_error(e, f'{service_url}{request_path}')
+                route_metrics.observe('upstream', phase_started)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        'proxy method=%s url=%s%s status=%s elapsed_ms=%.1f stream=1',
+                        method, service_url, request_path, upstream.status,
+                        (time.perf_counter() - phase_started) * 1000,
                     )
-                    service_headers = header_generator(token_payload)
+                return StreamingResponse(
+                    iter_body(upstream),
+                    status_code=upstream.status,
+                    headers=forwardable_headers(upstream),
+                )
 
-            scope = request.scope
-            print("Service Header==========")
-            print(service_headers)
-            method = scope['method'].lower()
-            path = scope['path']
+            resp_data, status_code_from_service = await proxy.fetch(
+                request_path, method, payload, service_headers
+            )
+            phase_started = route_metrics.observe('upstream', phase_started)
+        response.status_code = status_code_from_service
 
-            payload_obj = kwargs.get(payload_key)
-            payload = payload_obj.dict() if payload_obj else {}
+        if entry_key is not None:
+            entry = proxy.store(entry_key, resp_data, status_code_from_service)
+            if entry is not None:
+                route_metrics.observe('serialize', phase_started)
+                return _cached_response(request, entry, 'MISS')
 
-            url = f'{service_url}{path}'
-            print(service_url)
+        if response_model is None:
+            # rendered here rather than by FastAPI so the time shows up in the metrics
             try:
-                print(url)
-                print(method)
-                print(payload)
-                print(service_headers)
-                resp_data, status_code_from_service = await make_request(
-                    url=url,
-                    method=method,
-                    data=payload,
-                    headers=service_headers,
-                )
-            except aiohttp.client_exceptions.ClientConnectorError:
-                raise HTTPException(
-                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                    detail='Service is unavailable.',
-                    headers={'WWW-Authenticate': 'Bearer'},
-                )
-            except aiohttp.client_exceptions.ContentTypeError:
-                raise HTTPException(
-                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                    detail='Service error.',
-                    headers={'WWW-Authenticate': 'Bearer'},
-                )
+                body = render_json(resp_data)
+            except (TypeError, ValueError):
+                return resp_data
+            route_metrics.observe('serialize', phase_started)
+            return Response(content=body, status_code=status_code_from_service, media_type='application/json')
 
-            response.status_code = status_code_from_service
+        return resp_data
 
-            if all([
-                status_code_from_service == status_code,
-                post_processing_func
-            ]):
-                post_processing_f = import_function(post_processing_func)
-                resp_data = post_processing_f(resp_data)
-
-            return resp_data
+    def wrapper(f):
+        @app_any
+        @functools.wraps(f)
+        async def inner(request: Request, response: Response, **kwargs):
+            started = time.perf_counter()
+            route_metrics.in_flight += 1
+            sent_status = status.HTTP_500_INTERNAL_SERVER_ERROR
+            try:
+                result = await handle(request, response, kwargs, started)
+                if isinstance(result, Response):
+                    sent_status = result.status_code
+                else:
+                    sent_status = response.status_code or status_code
+                return result
+            except HTTPException as e:
+                sent_status = e.status_code
+                raise
+            finally:
+                route_metrics.in_flight -= 1
+                route_metrics.finish(sent_status, started)
 
     return wrapper
 
 
+# Every route() declaration, in registration order; /batch dispatches through it
+route_registry: List['ProxyRoute'] = []
+
+
+def match_route(method: str, path: str) -> Tuple[Optional['ProxyRoute'], dict]:
+    """The registered route serving method + path, and its path parameters."""
+    method = method.lower()
+    for proxy in route_registry:
+        if proxy.method == method:
+            match = proxy.path_regex.match(path)
+            if match:
+                return proxy, match.groupdict()
+    return None, {}
+
+
+class RouteAuth:
+    """
+    The request -> service headers step of a route: token decoding,
+    authorization check and header generation, with every dependency
+    resolved up front. decode() and service_headers() are also usable on
+    their own, so a batch can decode its token once for all sub-requests.
+    """
+
+    def __init__(
+            self,
+            authentication_required: bool,
+            authentication_token_decoder: str,
+            service_authorization_checker: str,
+            service_header_generator: str,
+    ):
+        self.required = authentication_required
+        self.token_decoder = None
+        self.authorization_checker = None
+        self.header_generator = None
+        if not authentication_required:
+            return
+        self.token_decoder = resolve_function(authentication_token_decoder)
+        if service_authorization_checker:
+            self.authorization_checker = resolve_function(service_authorization_checker)
+        if service_header_generator:
+            self.header_generator = resolve_function(service_header_generator)
+
+    def decode(self, authorization: Optional[str]) -> dict:
+        # authentication
+        try:
+            return self.token_decoder(authorization)
+        except Exception as e:
+            # AuthTokenMissing / AuthTokenExpired / AuthTokenCorrupted, or an
+            # unexpected error from a decoder injected by dotted path
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=str(e),
+                headers={'WWW-Authenticate': 'Bearer'},
+            )
+
+    def service_headers(self, token_payload: dict) -> dict:
+        # authorization
+        if self.authorization_checker and not self.authorization_checker(token_payload):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail='You are not allowed to access this scope.',
+                headers={'WWW-Authenticate': 'Bearer'},
+            )
+
+        # service headers
+        return self.header_generator(token_payload) if self.header_generator else {}
+
+    def __call__(self, request: Request) -> dict:
+        if not self.required:
+            return {}
+        return self.service_headers(self.decode(request.headers.get('authorization')))
+
+
+class ProxyRoute:
+    """The compiled, buffered proxy pipeline of one route() declaration."""
+
+    def __init__(
+            self, method: str, path: str, status_code: int, service_url: str,
+            auth: RouteAuth, post_processor: Optional[Callable], coalesce: bool,
+            cache_ttl: int, make_cache_key: Callable, sticky: bool,
+            rate_limiter: Optional[RateLimiter] = None,
+            concurrency: Optional[ConcurrencyLimiter] = None,
+    ):
+        self.method = method
+        self.path = path
+        self.path_regex = compile_path(path)[0]
+        self.status_code = status_code
+        self.service_url = service_url
+        self.auth = auth
+        self.post_processor = post_processor
+        self.coalesce = coalesce
+        self.cache_ttl = cache_ttl
+        self.make_cache_key = make_cache_key
+        self.sticky = sticky
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+
+    @staticmethod
+    def user_key(request: Request, service_headers: dict) -> str:
+        """Who admission control accounts a request to: the user, or the client address."""
+        user_id = service_headers.get('request-user-id')
+        if user_id:
+            return user_id
+        return request.client.host if request.client else 'anonymous'
+
+    def admit(self, user_key: str):
+        """Async context manager holding the route's rate-limit token and concurrency slot."""
+        return admit(user_key, self.rate_limiter, self.concurrency)
+
+    def sticky_key(self, service_headers: dict) -> Optional[str]:
+        return service_headers.get('request-user-id') if self.sticky else None
+
+    def cached(self, request: Request, service_headers: dict) -> Tuple[Optional[str], Optional[CachedResponse]]:
+        """(cache key, live entry): key is None when the request is not cacheable."""
+        if not self.cache_ttl or request.scope['method'] != 'GET':
+            return None, None
+        key = self.make_cache_key(request, service_headers)
+        return key, response_cache.get(key)
+
+    def store(self, key: str, resp_data, status_code_from_service: int) -> Optional[CachedResponse]:
+        if status_code_from_service != self.status_code:
+            return None
+        try:
+            body = render_json(resp_data)
+        except (TypeError, ValueError):
+            # not plain JSON, let FastAPI deal with it uncached
+            return None
+        return response_cache.put(key, body, status_code_from_service, self.cache_ttl)
+
+    async def fetch(self, request_path: str, method: str, payload: dict, service_headers: dict):
+        """Buffered upstream call (coalesced when enabled) -> (post-processed data, status)."""
+        url = f'{self.service_url}{request_path}'
+        debug = logger.isEnabledFor(logging.DEBUG)
+        started = time.perf_counter() if debug else 0.0
+
+        call = functools.partial(
+            make_request,
+            service_url=self.service_url,
+            path=request_path,
+            method=method,
+            data=payload,
+            headers=service_headers,
+            sticky_key=self.sticky_key(service_headers),
+        )
+        try:
+            if self.coalesce and method == 'get':
+                flight_key = (url, tuple(sorted(service_headers.items())))
+                resp_data, status_code_from_service = await upstream_flights.do(flight_key, call)
+                if self.post_processor:
+                    # post processors may mutate the data other callers share
+                    resp_data = copy.deepcopy(resp_data)
+            else:
+                resp_data, status_code_from_service = await call()
+        except UPSTREAM_ERRORS as e:
+            raise upstream_error(e, url)
+
+        if debug:
+            logger.debug(
+                'proxy method=%s url=%s status=%s elapsed_ms=%.1f stream=0',
+                method, url, status_code_from_service, (time.perf_counter() - started) * 1000,
+            )
+
+        if self.post_processor and status_code_from_service == self.status_code:
+            resp_data = self.post_processor(resp_data)
+        return resp_data, status_code_from_service
+
+
+UPSTREAM_ERRORS = (
+    CircuitOpenError,
+    asyncio.TimeoutError,
+    aiohttp.client_exceptions.ClientConnectorError,
+    aiohttp.client_exceptions.ContentTypeError,
+)
+
+
+def upstream_error(exc: Exception, url: str) -> HTTPException:
+    """Map an UPSTREAM_ERRORS exception to the HTTP error the client gets."""
+    if isinstance(exc, CircuitOpenError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Service is unavailable.',
+            headers={'Retry-After': str(max(1, int(exc.retry_after)))},
+        )
+    if isinstance(exc, asyncio.TimeoutError):
+        logger.warning('upstream timed out url=%s', url)
+        return HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail='Service timed out.',
+        )
+    if isinstance(exc, aiohttp.client_exceptions.ClientConnectorError):
+        logger.warning('upstream unavailable url=%s', url)
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='Service is unavailable.',
+            headers={'WWW-Authenticate': 'Bearer'},
+        )
+    logger.warning('upstream returned non-JSON url=%s', url)
+    return HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail='Service error.',
+        headers={'WWW-Authenticate': 'Bearer'},
+    )
+
+
+def default_cache_key(request: Request, service_headers: dict) -> str:
+    """Path and query of the request plus the service headers (the user on authenticated routes)."""
+    scope = request.scope
+    query = scope.get('query_string', b'').decode('latin-1')
+    headers = '&'.join(f'{name}={value}' for name, value in sorted(service_headers.items()))
+    return f'{scope["path"]}?{query}#{headers}'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+
+def _cached_response(request: Request, entry: CachedResponse, outcome: str) -> Response:
+    max_age = max(0, int(entry.expires_at - time.time()))
+    headers = {
+        'ETag': entry.etag,
+        'Cache-Control': f'private, max-age={max_age}',
+        'X-Cache': outcome,
+    }
+    if _etag_matches(request, entry.etag):
+        response_cache.not_modified += 1
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=entry.body, status_code=entry.status,
+        media_type='application/json', headers=headers,
+    )
+
+
+def resolve_function(method_path):
+    """
+    Strict import_function for registration time: raises instead of falling
+    back to a no-op when the module or attribute does not exist.
+    """
+    module, method = method_path.rsplit('.', 1)
+    target = getattr(import_module(module), method, None)
+    if target is None or not callable(target):
+        raise ValueError(f'{method_path} is not a callable')
+    return target
+
+
 def import_function(method_path):
     module, method = method_path.rsplit('.', 1)
     mod = import_module(module)
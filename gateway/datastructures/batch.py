@@ -0,0 +1,15 @@
+from pydantic import BaseModel
+from typing import Any, List, Optional
+
+
+class BatchSubRequest(BaseModel):
+    # echoed back so the caller can pair results with requests
+    id: Optional[str]
+    method: str = 'GET'
+    # gateway path including path parameters, e.g. /api/v1_0/fyres/volatility_of_month/03/2025/NIFTY
+    path: str
+    body: Optional[Any]
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
@@ -0,0 +1,25 @@
+"""
+JSON encoding of proxied bodies. orjson parses and renders them several
+times faster than the standard library when it is installed; without it the
+gateway falls back to json with JSONResponse's settings.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, see requirements.txt
+    orjson = None
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(data) -> bytes:
+        return orjson.dumps(data)
+else:
+    loads = json.loads
+
+    def dumps(data) -> bytes:
+        return json.dumps(
+            data, ensure_ascii=False, allow_nan=False, indent=None, separators=(',', ':')
+        ).encode('utf-8')
@@ -1,7 +1,19 @@
-from fastapi import FastAPI, status, Request, Response
+import asyncio
+import logging
+
+from fastapi import Depends, FastAPI, HTTPException, status, Request, Response
 from typing import List
 from conf import settings
-from core import route 
+from core import UPSTREAM_ERRORS, RouteAuth, route 
+from batch import dispatch_batch
+from admission import concurrency_stats
+from metrics import gateway_metrics
+from network import make_request, upstream_pool
+from response_cache import response_cache
+from singleflight import upstream_flights
+from compression import CompressionMiddleware
+from tracing import TracingMiddleware, summarize
+from tracing import collector as trace_collector
 from fastapi.middleware.cors import CORSMiddleware
 from auth import *
 
@@ -14,10 +26,119 @@ from datastructures.users import *
 from datastructures.break_even import *
 from datastructures.volatility import *
 from datastructures.implied_volatility import *
+from datastructures.batch import BatchRequest
 
+logging.basicConfig(
+    level=settings.GATEWAY_LOG_LEVEL.upper(),
+    format='%(asctime)s %(levelname)s %(name)s %(message)s',
+)
 
 app = FastAPI()
 
+# Operational endpoints (cache stats, traces, metrics) expose other users'
+# requests and internals: admins only, Prometheus scrapes with an admin token
+admin_only = RouteAuth(
+    authentication_required=True,
+    authentication_token_decoder='auth.decode_access_token',
+    service_authorization_checker='auth.is_admin_user',
+    service_header_generator=None,
+)
+
+gateway_metrics.add_collector('response_cache', response_cache.stats)
+gateway_metrics.add_collector('token_cache', token_cache.stats)
+gateway_metrics.add_collector('coalesced', upstream_flights.stats)
+gateway_metrics.add_collector('replica', upstream_pool.replica_stats, ('service', 'replica'))
+gateway_metrics.add_collector('breaker', upstream_pool.breaker_stats, ('origin',))
+gateway_metrics.add_collector('concurrency', concurrency_stats, ('service',))
+
+
+@app.on_event("startup")
+async def start_upstream_pool():
+    await upstream_pool.start([
+        settings.NSE_SERVICE_URL,
+        settings.USER_SERVICE_URL,
+        settings.BREAKEVEN_SERVICE_URL,
+    ])
+
+
+@app.on_event("shutdown")
+async def close_upstream_pool():
+    await upstream_pool.close()
+    response_cache.close()
+
+
+@app.post('/api/v1_0/batch', status_code=status.HTTP_200_OK)
+async def batch_requests(batch_request: BatchRequest, request: Request):
+    """
+    Several gateway calls in one round trip, e.g. on dashboard page load:
+    {"requests": [{"id": "sim", "method": "GET", "path": "/api/v1_0/strategy/simulation"}, ...]}
+    Sub-requests run concurrently; results come back in request order.
+    """
+    return {'responses': await dispatch_batch(request, batch_request.requests)}
+
+
+@app.get('/api/v1_0/gateway/cache-stats', status_code=status.HTTP_200_OK, dependencies=[Depends(admin_only)])
+async def cache_stats():
+    return {
+        'responses': response_cache.stats(),
+        'tokens': token_cache.stats(),
+        'coalesced': upstream_flights.stats(),
+    }
+
+
+@app.get('/api/v1_0/gateway/traces', status_code=status.HTTP_200_OK, dependencies=[Depends(admin_only)])
+async def recent_traces(limit: int = 50):
+    """Latest requests through the gateway, newest first; see /traces/{trace_id} for one of them."""
+    return {'requests': trace_collector.recent(min(limit, 500))}
+
+
+@app.get('/api/v1_0/gateway/traces/{trace_id}', status_code=status.HTTP_200_OK, dependencies=[Depends(admin_only)])
+async def trace_summary(trace_id: str, request: Request):
+    """
+    One request end to end: the gateway's spans plus those every nse and
+    breakeven replica recorded for the trace, and where the time went.
+    The replicas check the admin token too, so it is passed on.
+    """
+    local = trace_collector.get(trace_id)
+    spans = list(local['spans']) if local else []
+    dropped = local['dropped'] if local else 0
+    replica_urls = sorted({
+        replica.base_url
+        for service_url in (settings.NSE_SERVICE_URL, settings.USER_SERVICE_URL, settings.BREAKEVEN_SERVICE_URL)
+        if service_url
+        for replica in upstream_pool.replicas_for(service_url).replicas
+    })
+
+    async def fetch(base_url):
+        try:
+            body, status_code = await make_request(
+                base_url, f'/api/v1_0/traces/{trace_id}', 'get',
+                headers={'authorization': request.headers.get('authorization')},
+            )
+        except UPSTREAM_ERRORS:
+            return None
+        return body if status_code == status.HTTP_200_OK else None
+
+    for trace in await asyncio.gather(*(fetch(base_url) for base_url in replica_urls)):
+        if trace:
+            spans.extend(trace['spans'])
+            dropped += trace['dropped']
+    if not spans:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Trace not found or evicted')
+    spans.sort(key=lambda item: item['started_at'])
+    return {'trace_id': trace_id, 'summary': summarize(spans), 'dropped': dropped, 'spans': spans}
+
+
+@app.get('/metrics', status_code=status.HTTP_200_OK, include_in_schema=False, dependencies=[Depends(admin_only)])
+async def metrics():
+    """Prometheus text exposition of the gateway metrics."""
+    return Response(gateway_metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/metrics.json', status_code=status.HTTP_200_OK, include_in_schema=False, dependencies=[Depends(admin_only)])
+async def metrics_json():
+    return gateway_metrics.as_dict()
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins= ["*"], #["http://localhost:8080"],
@@ -26,6 +147,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware)
+# added last so it wraps CORS too and every answer carries X-Trace-Id
+app.add_middleware(TracingMiddleware, service='gateway', exclude=('/metrics', '/api/v1_0/gateway/'))
+
 
 
 @route(
@@ -73,7 +198,9 @@ o   o o--o  o--o
     payload_key=None,
     service_url=settings.NSE_SERVICE_URL,
     authentication_required=False,
-    response_model=None
+    response_model=None,
+    coalesce=True,
+    cache_ttl=900
 )
 async def search_data(from_date: str, to_date: str, instrument_type: str, symbol: str, 
     year: int, expiry_date: str, option_type: str, strike_price: float,
@@ -174,7 +301,10 @@ async def search_data(from_date: str, to_date: str, instrument_type: str, symbol
     authentication_token_decoder='auth.decode_access_token',
     service_authorization_checker='auth.is_default_user',
     service_header_generator='auth.generate_request_header',
-    response_model=None
+    response_model=None,
+    sticky=True,
+    rate_limit='10/minute',
+    limit_concurrency=True
     )
 async def strategy_simulation(request: Request, response: Response):
     pass
@@ -191,7 +321,10 @@ async def strategy_simulation(request: Request, response: Response):
     authentication_token_decoder='auth.decode_access_token',
     service_authorization_checker='auth.is_default_user',
     service_header_generator='auth.generate_request_header',
-    response_model=None
+    response_model=None,
+    sticky=True,
+    rate_limit='10/minute',
+    limit_concurrency=True
     )
 async def monthly_strategy_simulation(
     month: str,
@@ -211,7 +344,10 @@ async def monthly_strategy_simulation(
     authentication_token_decoder='auth.decode_access_token',
     service_authorization_checker='auth.is_default_user',
     service_header_generator='auth.generate_request_header',
-    response_model=None
+    response_model=None,
+    sticky=True,
+    rate_limit='10/minute',
+    limit_concurrency=True
     )
 async def monthly_volatility_simulation(
     month: str,
@@ -435,7 +571,9 @@ async def access_token(request: Request, response: Response):
     authentication_token_decoder='auth.decode_access_token',
     service_authorization_checker='auth.is_default_user',
     service_header_generator='auth.generate_request_header',
-    response_model=None
+    response_model=None,
+    rate_limit='3/minute',
+    limit_concurrency=True
     )
 async def calculate_volatility_api(payload:VolatilityRequest, request: Request, response: Response):
     pass
@@ -452,7 +590,9 @@ async def calculate_volatility_api(payload:VolatilityRequest, request: Request,
     authentication_token_decoder='auth.decode_access_token',
     service_authorization_checker='auth.is_default_user',
     service_header_generator='auth.generate_request_header',
-    response_model=None
+    response_model=None,
+    coalesce=True,
+    limit_concurrency=True
     )
 async def volatility_of_month(
     month: str,
@@ -463,6 +603,78 @@ async def volatility_of_month(
     pass
 
 
+# Background jobs: submit returns 202 with a job id, then poll status / result
+
+@route(
+    request_method=app.post,
+    path='/api/v1_0/jobs/volatility',
+    status_code=status.HTTP_202_ACCEPTED,
+    payload_key='payload',
+    service_url=settings.NSE_SERVICE_URL,
+    authentication_required=True,
+    post_processing_func=None,
+    authentication_token_decoder='auth.decode_access_token',
+    service_authorization_checker='auth.is_default_user',
+    service_header_generator='auth.generate_request_header',
+    response_model=None,
+    rate_limit='5/minute'
+    )
+async def submit_volatility_job(payload: VolatilityRequest, request: Request, response: Response):
+    pass
+
+
+@route(
+    request_method=app.post,
+    path='/api/v1_0/jobs/strategy_simulation',
+    status_code=status.HTTP_202_ACCEPTED,
+    payload_key=None,
+    service_url=settings.NSE_SERVICE_URL,
+    authentication_required=True,
+    post_processing_func=None,
+    authentication_token_decoder='auth.decode_access_token',
+    service_authorization_checker='auth.is_default_user',
+    service_header_generator='auth.generate_request_header',
+    response_model=None,
+    rate_limit='5/minute'
+    )
+async def submit_strategy_simulation_job(request: Request, response: Response):
+    pass
+
+
+@route(
+    request_method=app.get,
+    path='/api/v1_0/jobs/{job_id}',
+    status_code=status.HTTP_200_OK,
+    payload_key=None,
+    service_url=settings.NSE_SERVICE_URL,
+    authentication_required=True,
+    post_processing_func=None,
+    authentication_token_decoder='auth.decode_access_token',
+    service_authorization_checker='auth.is_default_user',
+    service_header_generator='auth.generate_request_header',
+    response_model=None
+    )
+async def job_status(job_id: str, request: Request, response: Response):
+    pass
+
+
+@route(
+    request_method=app.get,
+    path='/api/v1_0/jobs/{job_id}/result',
+    status_code=status.HTTP_200_OK,
+    payload_key=None,
+    service_url=settings.NSE_SERVICE_URL,
+    authentication_required=True,
+    post_processing_func=None,
+    authentication_token_decoder='auth.decode_access_token',
+    service_authorization_checker='auth.is_default_user',
+    service_header_generator='auth.generate_request_header',
+    response_model=None
+    )
+async def job_result(job_id: str, request: Request, response: Response):
+    pass
+
+
 
 
 '''
@@ -0,0 +1,191 @@
+"""
+In-process request metrics of the gateway, exposed at /metrics in the
+Prometheus text format (0.0.4) and at /metrics.json.
+
+Every route() registers a RouteMetrics holding its status counters, an
+in-flight gauge and latency histograms for the whole request and for each
+phase of it: auth (token decode and checks), admission (rate limit and
+concurrency waits), upstream (until the upstream answered) and serialize
+(rendering the JSON body). Pool, cache and limiter statistics are read from
+their owners when the metrics are rendered.
+"""
+import time
+
+from typing import Callable, Dict, List, Tuple
+
+# seconds; the upper ones cover long simulations that stay under GATEWAY_TIMEOUT
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PHASES = ('auth', 'admission', 'upstream', 'serialize')
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.sum += seconds
+        self.count += 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        buckets, running = [], 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            running += count
+            buckets.append((repr(float(bound)), running))
+        buckets.append(('+Inf', self.count))
+        return buckets
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (0 when empty)."""
+        if not self.count:
+            return 0.0
+        rank, running = q * self.count, 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            running += count
+            if running >= rank:
+                return float(bound)
+        return float('inf')
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class RouteMetrics:
+    def __init__(self, method: str, route: str):
+        self.method = method
+        self.route = route
+        self.statuses: Dict[int, int] = {}
+        self.in_flight = 0
+        self.duration = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+
+    def observe(self, phase: str, started: float) -> float:
+        """Record the phase that began at perf_counter() value started; returns now."""
+        now = time.perf_counter()
+        self.phases[phase].observe(now - started)
+        return now
+
+    def finish(self, status_code: int, started: float):
+        self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+        self.duration.observe(time.perf_counter() - started)
+
+    def as_dict(self) -> dict:
+        return {
+            'method': self.method,
+            'route': self.route,
+            'requests': sum(self.statuses.values()),
+            'statuses': {str(code): count for code, count in sorted(self.statuses.items())},
+            'in_flight': self.in_flight,
+            'duration': self.duration.as_dict(),
+            'phases': {phase: histogram.as_dict() for phase, histogram in self.phases.items()},
+        }
+
+
+def _labels(**labels) -> str:
+    def escape(value) -> str:
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _flatten(prefix: str, stats: dict, label_names: Tuple[str, ...], labels: dict,
+             out: List[Tuple[str, dict, float]]):
+    """
+    Leaves of a stats dict as (metric name, labels, value) samples. Nested
+    dicts become labels named by label_names, one per nesting level; string
+    leaves (e.g. a breaker state) become a 1-valued sample labelled with it.
+    """
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            _flatten(prefix, value, label_names, {**labels, label_names[len(labels)]: key}, out)
+        elif isinstance(value, (int, float)):
+            out.append((f'{prefix}_{key}', labels, float(value)))
+        elif isinstance(value, str):
+            out.append((f'{prefix}_{key}', {**labels, key: value}, 1.0))
+
+
+class GatewayMetrics:
+    def __init__(self):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        # name -> (callable returning a stats dict, label names of its nesting levels)
+        self.collectors: Dict[str, Tuple[Callable[[], dict], Tuple[str, ...]]] = {}
+
+    def route(self, method: str, route: str) -> RouteMetrics:
+        key = (method.upper(), route)
+        if key not in self.routes:
+            self.routes[key] = RouteMetrics(*key)
+        return self.routes[key]
+
+    def add_collector(self, name: str, collect: Callable[[], dict], label_names: Tuple[str, ...] = ()):
+        """Export collect()'s numbers as gateway_<name>_<stat> gauges."""
+        self.collectors[name] = (collect, label_names)
+
+    def as_dict(self) -> dict:
+        return {
+            'routes': [metrics.as_dict() for metrics in self.routes.values()],
+            **{name: collect() for name, (collect, _) in self.collectors.items()},
+        }
+
+    def render_prometheus(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('gateway_requests_total', 'counter', 'Requests handled per route and status code.')
+        for metrics in self.routes.values():
+            for code, count in sorted(metrics.statuses.items()):
+                labels = _labels(method=metrics.method, route=metrics.route, status=code)
+                lines.append(f'gateway_requests_total{labels} {count}')
+
+        family('gateway_in_flight_requests', 'gauge', 'Requests currently being handled per route.')
+        for metrics in self.routes.values():
+            lines.append(f'gateway_in_flight_requests{_labels(method=metrics.method, route=metrics.route)} {metrics.in_flight}')
+
+        def histogram_lines(name: str, histogram: Histogram, **labels):
+            for bound, count in histogram.cumulative():
+                lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {count}')
+            lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+            lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+        family('gateway_request_duration_seconds', 'histogram', 'Whole request latency per route.')
+        for metrics in self.routes.values():
+            histogram_lines('gateway_request_duration_seconds', metrics.duration,
+                            method=metrics.method, route=metrics.route)
+
+        family('gateway_request_phase_seconds', 'histogram',
+               'Latency per request phase: auth, admission, upstream, serialize.')
+        for metrics in self.routes.values():
+            for phase, histogram in metrics.phases.items():
+                histogram_lines('gateway_request_phase_seconds', histogram,
+                                method=metrics.method, route=metrics.route, phase=phase)
+
+        for name, (collect, label_names) in self.collectors.items():
+            samples: List[Tuple[str, dict, float]] = []
+            _flatten(f'gateway_{name}', collect(), label_names, {}, samples)
+            # the exposition format wants the samples of a metric in one group
+            samples.sort(key=lambda sample: sample[0])
+            current = None
+            for metric, labels, value in samples:
+                if metric != current:
+                    family(metric, 'gauge', f'{name} statistics.')
+                    current = metric
+                lines.append(f'{metric}{_labels(**labels) if labels else ""} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+gateway_metrics = GatewayMetrics()
@@ -1,21 +1,328 @@
 import aiohttp
+import asyncio
 import async_timeout
+import hashlib
+import logging
+import random
+import time
+import zlib
+from multidict import CIMultiDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Tuple
+from urllib.parse import urlsplit
 
 from conf import settings
+from fast_json import loads
+from tracing import span, trace_headers
+
+# Headers that describe one hop and must not be forwarded by a proxy (RFC 7230 6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade",
+}
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# content codings accepted on the buffered path, with their zlib wbits
+DECODERS = {"gzip": 16 + zlib.MAX_WBITS, "deflate": zlib.MAX_WBITS}
+
+# Methods that may be sent again after a failed attempt
+IDEMPOTENT_METHODS = {"get", "head", "options"}
+# Upstream statuses that mean "unreachable", not "bad request". A 503 is the
+# service saying it is overloaded (with Retry-After), not that the replica is
+# down, so it is passed on without a retry or a breaker failure.
+UNAVAILABLE_STATUSES = {502, 504}
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(f"{origin} is failing, calls are suspended for {retry_after:.0f}s")
+        self.origin = origin
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker for one upstream.
+
+    closed: calls go through; BREAKER_FAILURE_THRESHOLD failures in a row open it.
+    open: calls fail fast for BREAKER_RESET_SECONDS.
+    half_open: up to BREAKER_HALF_OPEN_PROBES calls are let through; a success
+    closes the breaker, a failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, origin: str, failure_threshold: int, reset_seconds: float, half_open_probes: int):
+        self.origin = origin
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = half_open_probes
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+        self._probes_started_at = 0.0
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.reset_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+        if self.state == self.HALF_OPEN:
+            # a probe whose caller went away never reports back, so the probe
+            # budget is renewed after another reset period
+            if self._probes >= self.half_open_probes and now - self._probes_started_at < self.reset_seconds:
+                return False
+            if self._probes == 0 or self._probes >= self.half_open_probes:
+                self._probes, self._probes_started_at = 0, now
+            self._probes += 1
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("circuit for %s closed", self.origin)
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning("circuit for %s opened after %d failures", self.origin, self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "retry_after": round(self.retry_after(), 1)}
+
+
+class Replica:
+    """One instance of an upstream service; its circuit breaker doubles as the passive health check."""
+
+    __slots__ = ("base_url", "breaker", "outstanding")
+
+    def __init__(self, base_url: str, breaker: CircuitBreaker):
+        self.base_url = base_url
+        self.breaker = breaker
+        self.outstanding = 0
+
+    def healthy(self) -> bool:
+        return self.breaker.state != CircuitBreaker.OPEN or self.breaker.retry_after() <= 0
+
+    def stats(self) -> dict:
+        return {"outstanding": self.outstanding, **self.breaker.stats()}
+
+
+class ReplicaSet:
+    """
+    Replicas of one service, from a comma-separated service url setting.
+
+    Requests go to the healthy replica with the fewest outstanding requests.
+    With a sticky key (e.g. the user id), rendezvous hashing keeps the key on
+    the same healthy replica, and moves only that key's traffic when it fails.
+    """
+
+    def __init__(self, service_url: str, replicas: List[Replica]):
+        self.service_url = service_url
+        self.replicas = replicas
+
+    @staticmethod
+    def _rendezvous_score(key: str, replica: Replica) -> bytes:
+        return hashlib.sha1(f"{key}|{replica.base_url}".encode()).digest()
+
+    def _preference(self, sticky_key: str = None) -> List[Replica]:
+        if len(self.replicas) == 1:
+            return self.replicas
+        if sticky_key is not None:
+            return sorted(
+                self.replicas,
+                key=lambda replica: (replica.healthy(), self._rendezvous_score(sticky_key, replica)),
+                reverse=True,
+            )
+        return sorted(
+            self.replicas,
+            key=lambda replica: (not replica.healthy(), replica.outstanding, random.random()),
+        )
+
+    def acquire(self, sticky_key: str = None, avoid=()) -> Replica:
+        """Pick the replica for the next attempt, preferring ones not in avoid (already tried)."""
+        ordered = self._preference(sticky_key)
+        if avoid:
+            ordered = [r for r in ordered if r not in avoid] + [r for r in ordered if r in avoid]
+        for replica in ordered:
+            if replica.breaker.allow():
+                return replica
+        raise CircuitOpenError(
+            self.service_url, min(replica.breaker.retry_after() for replica in self.replicas)
+        )
+
+    def stats(self) -> Dict[str, dict]:
+        return {replica.base_url: replica.stats() for replica in self.replicas}
+
+
+class UpstreamPool:
+    """
+    One long-lived, pooled aiohttp session per upstream service (per origin),
+    so proxied requests reuse keep-alive connections instead of paying DNS,
+    TCP connect and a new connector on every call.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._replica_sets: Dict[str, ReplicaSet] = {}
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def session_for(self, url: str) -> aiohttp.ClientSession:
+        origin = self._origin(url)
+        session = self._sessions.get(origin)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.UPSTREAM_POOL_LIMIT,
+                limit_per_host=settings.UPSTREAM_POOL_LIMIT_PER_HOST,
+                keepalive_timeout=settings.UPSTREAM_KEEPALIVE_SECONDS,
+                ttl_dns_cache=settings.UPSTREAM_DNS_CACHE_SECONDS,
+            )
+            # bodies are read as they were sent, so streamed ones pass through
+            # still compressed; read_json inflates buffered ones
+            session = aiohttp.ClientSession(connector=connector, auto_decompress=False)
+            self._sessions[origin] = session
+        return session
+
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        origin = self._origin(url)
+        breaker = self._breakers.get(origin)
+        if breaker is None:
+            breaker = self._breakers[origin] = CircuitBreaker(
+                origin,
+                settings.BREAKER_FAILURE_THRESHOLD,
+                settings.BREAKER_RESET_SECONDS,
+                settings.BREAKER_HALF_OPEN_PROBES,
+            )
+        return breaker
+
+    def replicas_for(self, service_url: str) -> ReplicaSet:
+        """The ReplicaSet of a service url setting ("http://nse-1:8000,http://nse-2:8000")."""
+        replica_set = self._replica_sets.get(service_url)
+        if replica_set is None:
+            base_urls = [url.strip().rstrip("/") for url in service_url.split(",") if url.strip()]
+            replica_set = self._replica_sets[service_url] = ReplicaSet(
+                service_url, [Replica(url, self.breaker_for(url)) for url in base_urls]
+            )
+        return replica_set
+
+    def replica_stats(self) -> Dict[str, dict]:
+        return {service_url: replicas.stats() for service_url, replicas in self._replica_sets.items()}
+
+    def breaker_stats(self) -> Dict[str, dict]:
+        return {origin: breaker.stats() for origin, breaker in self._breakers.items()}
+
+    async def start(self, service_urls: Iterable[str]):
+        """Create the pools of the configured services up front (app startup)."""
+        for service_url in service_urls:
+            if service_url:
+                for replica in self.replicas_for(service_url).replicas:
+                    self.session_for(replica.base_url)
+
+    async def close(self):
+        """Close every pool (app shutdown)."""
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+upstream_pool = UpstreamPool()
+
+
+def attempt_timeout() -> aiohttp.ClientTimeout:
+    """Per-attempt limits: connecting (pool wait included) and each socket read."""
+    return aiohttp.ClientTimeout(
+        total=None,
+        connect=settings.UPSTREAM_CONNECT_TIMEOUT,
+        sock_read=settings.UPSTREAM_READ_TIMEOUT,
+    )
+
+
+async def call_upstream(
+    replicas: "ReplicaSet",
+    path: str,
+    method: str,
+    attempt: Callable[[str], Awaitable[Tuple[Any, int]]],
+    discard: Callable[[Any], None] = None,
+    sticky_key: str = None,
+):
+    """
+    Run attempt(url) -> (result, upstream status) against a replica of the
+    service picked by ReplicaSet.acquire, behind that replica's circuit
+    breaker. Connection errors, timeouts and 502/504 count as failures;
+    idempotent methods are retried on them up to UPSTREAM_RETRIES times with
+    full-jitter exponential backoff, on another replica when there is one.
+    discard(result) is called on a result that is thrown away for a retry.
+    """
+    retries = settings.UPSTREAM_RETRIES if method.lower() in IDEMPOTENT_METHODS else 0
+    tried = set()
+    for attempt_no in range(retries + 1):
+        replica = replicas.acquire(sticky_key, tried)
+        tried.add(replica)
+        breaker = replica.breaker
+        last_attempt = attempt_no == retries
+        replica.outstanding += 1
+        url = f"{replica.base_url}{path}"
+        try:
+            with span("upstream", "http", url=url, method=method.upper(), attempt=attempt_no + 1) as current:
+                result, status = await attempt(url)
+                if current is not None:
+                    current.attributes["status"] = status
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            breaker.record_failure()
+            if last_attempt:
+                raise
+        else:
+            if status not in UNAVAILABLE_STATUSES:
+                breaker.record_success()
+                return result
+            breaker.record_failure()
+            if last_attempt:
+                return result
+            if discard:
+                discard(result)
+        finally:
+            replica.outstanding -= 1
+        delay = random.uniform(0, settings.UPSTREAM_RETRY_BACKOFF_SECONDS * 2 ** attempt_no)
+        logger.info("retrying %s %s%s in %.2fs (attempt %d)", method, replica.base_url, path, delay, attempt_no + 2)
+        await asyncio.sleep(delay)
 
 
 async def make_request(
-    url: str,
+    service_url: str,
+    path: str,
     method: str,
     data: dict = None,
-    headers: dict = None
+    headers: dict = None,
+    sticky_key: str = None
 ):
     """
     Args:
-        url: is the url for one of the in-network services
+        service_url: base url of one of the in-network services, or a
+            comma-separated list of its replicas
+        path: is the path to request on the service
         method: is the lower version of one of the HTTP methods: GET, POST, PUT, DELETE # noqa
         data: is the payload
         headers: is the header to put additional headers into request
+        sticky_key: keeps requests with the same key on the same replica
 
     Returns:
         service result coming / non-blocking http request (coroutine)
@@ -31,10 +338,97 @@ async def make_request(
     """
     if not data:
         data = {}
+    headers = headers or {}
+
+    async def attempt(url):
+        session = upstream_pool.session_for(url)
+        async with session.request(
+            method.upper(), url, json=data, timeout=attempt_timeout(),
+            headers={"Accept-Encoding": ", ".join(DECODERS), **headers, **trace_headers()},
+        ) as response:
+            body = await read_json(response)
+            return (body, response.status), response.status
+
+    # GATEWAY_TIMEOUT bounds the whole call, retries included
+    async with async_timeout.timeout(settings.GATEWAY_TIMEOUT):
+        return await call_upstream(
+            upstream_pool.replicas_for(service_url), path, method, attempt, sticky_key=sticky_key
+        )
+
+
+async def stream_request(
+    service_url: str,
+    path: str,
+    method: str,
+    data: dict = None,
+    headers: dict = None,
+    sticky_key: str = None
+) -> aiohttp.ClientResponse:
+    """
+    Same request as make_request, but returns the upstream response with its
+    body unread so it can be streamed to the client. GATEWAY_TIMEOUT bounds
+    getting the response headers (retries included), UPSTREAM_READ_TIMEOUT
+    every read of the body. The caller must release() the response.
+    A replica counts the request as outstanding until the headers arrive.
+    The body is not decompressed: pass the client's Accept-Encoding in
+    headers to let the service compress it (identity otherwise).
+    """
+    if not data:
+        data = {}
+    headers = headers or {}
+
+    async def attempt(url):
+        session = upstream_pool.session_for(url)
+        response = await session.request(
+            method.upper(), url, json=data, timeout=attempt_timeout(),
+            headers={"Accept-Encoding": "identity", **headers, **trace_headers()},
+        )
+        return response, response.status
+
+    async with async_timeout.timeout(settings.GATEWAY_TIMEOUT):
+        return await call_upstream(
+            upstream_pool.replicas_for(service_url), path, method, attempt,
+            discard=lambda response: response.release(), sticky_key=sticky_key,
+        )
+
+
+def forwardable_headers(response: aiohttp.ClientResponse) -> CIMultiDict:
+    """
+    Upstream response headers minus hop-by-hop ones. The body is passed on
+    as it came, so its Content-Encoding and Content-Length still apply.
+    """
+    return CIMultiDict(
+        (name, value) for name, value in response.headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    )
+
+
+async def read_json(response: aiohttp.ClientResponse):
+    """
+    The JSON body of an upstream response, inflated first when the service
+    compressed it (the pool does not decompress). Raises ContentTypeError
+    for non-JSON answers, like ClientResponse.json().
+    """
+    if "json" not in response.content_type:
+        raise aiohttp.ContentTypeError(
+            response.request_info,
+            response.history,
+            message=f"Attempt to decode JSON with unexpected mimetype: {response.content_type}",
+            headers=response.headers,
+        )
+    body = await response.read()
+    coding = response.headers.get("Content-Encoding", "").lower()
+    if coding in DECODERS:
+        body = zlib.decompress(body, DECODERS[coding])
+    if not body.strip():
+        return None
+    return loads(body)
+
 
-    with async_timeout.timeout(settings.GATEWAY_TIMEOUT):
-        async with aiohttp.ClientSession() as session:
-            request = getattr(session, method)
-            async with request(url, json=data, headers=headers) as response:
-                data = await response.json()
-                return (data, response.status)
+async def iter_body(response: aiohttp.ClientResponse) -> AsyncIterator[bytes]:
+    """Yield the upstream body chunk by chunk and release the connection afterwards."""
+    try:
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+            yield chunk
+    finally:
+        response.release()
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import sqlite3
+import time
+
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from conf import settings
+from fast_json import dumps
+
+logger = logging.getLogger(__name__)
+
+# rows of expired entries are purged from the disk backend every N writes
+DISK_PURGE_EVERY = 200
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    status: int
+    etag: str
+    expires_at: float
+
+
+def render_json(data) -> bytes:
+    """Serialise a response body; the same data always renders to the same bytes."""
+    return dumps(data)
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.sha1(body).hexdigest()
+
+
+class DiskBackend:
+    """
+    Response cache rows in a local sqlite file, so every gateway worker on the
+    host sees what the others fetched. Rows are small and the file is local,
+    so calls are made inline.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            ' cache_key TEXT PRIMARY KEY, expires_at REAL NOT NULL,'
+            ' status INTEGER NOT NULL, etag TEXT NOT NULL, body BLOB NOT NULL)'
+        )
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        row = self._conn.execute(
+            'SELECT body, status, etag, expires_at FROM response_cache'
+            ' WHERE cache_key = ? AND expires_at > ?',
+            (key, time.time()),
+        ).fetchone()
+        return CachedResponse(bytes(row[0]), row[1], row[2], row[3]) if row else None
+
+    def put(self, key: str, entry: CachedResponse):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO response_cache (cache_key, expires_at, status, etag, body)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (key, entry.expires_at, entry.status, entry.etag, entry.body),
+        )
+        self._writes += 1
+        if self._writes % DISK_PURGE_EVERY == 0:
+            self._conn.execute('DELETE FROM response_cache WHERE expires_at <= ?', (time.time(),))
+
+    def close(self):
+        self._conn.close()
+
+
+class ResponseCache:
+    """
+    Rendered responses of cacheable gateway routes (route(cache_ttl=...)).
+
+    Entries live in an in-process LRU bounded by entry count and total body
+    bytes. When RESPONSE_CACHE_DB_PATH is set, they are also written to a
+    shared sqlite file; a memory miss then falls back to it.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, disk_path: str = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = DiskBackend(disk_path)
+            except sqlite3.Error as e:
+                logger.warning('response cache: disk backend %s unavailable (%s), memory only', disk_path, e)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.stores = 0
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def _remember(self, key: str, entry: CachedResponse):
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = entry
+        self._bytes += len(entry.body)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self._drop(key)
+        if self.disk is not None:
+            try:
+                entry = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning('response cache: disk read failed (%s)', e)
+                entry = None
+            if entry is not None:
+                self._remember(key, entry)
+                self.disk_hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key: str, body: bytes, status: int, ttl: int) -> CachedResponse:
+        entry = CachedResponse(body, status, make_etag(body), time.time() + ttl)
+        if len(body) > self.max_bytes:
+            return entry
+        self._remember(key, entry)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, entry)
+            except sqlite3.Error as e:
+                logger.warning('response cache: disk write failed (%s)', e)
+        self.stores += 1
+        return entry
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'disk': self.disk.path if self.disk is not None else None,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'stores': self.stores,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_MAX_ENTRIES,
+    settings.RESPONSE_CACHE_MAX_BYTES,
+    settings.RESPONSE_CACHE_DB_PATH,
+)
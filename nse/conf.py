@@ -15,11 +15,41 @@
 
 # settings = Settings() 
 
+import os
+import socket
 from pydantic import BaseSettings
 
 class Settings(BaseSettings):
     DB_CONFIG: str
     NSE_SERVICE_URL: str
+    # NSE holiday list used by services.trading_calendar
+    TRADING_HOLIDAYS_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nse_holidays.csv")
+    # Shared NSE website client (services.nse_service.get_nse_client)
+    NSE_COOKIE_TTL_SECONDS: int = 600
+    NSE_MAX_CONNECTIONS: int = 20
+    NSE_KEEPALIVE_SECONDS: int = 60
+    # Negative cache TTLs for NSE lookups that failed or came back empty
+    NEGATIVE_CACHE_ERROR_TTL_SECONDS: int = 900
+    NEGATIVE_CACHE_EMPTY_TTL_SECONDS: int = 3600
+    # Index symbols kept by the bhavcopy loader (db/load_bhavcopy.py)
+    BHAVCOPY_SYMBOLS: str = "NIFTY,BANKNIFTY,FINNIFTY"
+    # Background jobs (services.jobs): concurrent runs, waiting room and result lifetime
+    JOB_WORKERS: int = 2
+    JOB_QUEUE_SIZE: int = 50
+    JOB_RESULT_TTL_SECONDS: int = 3600
+    JOB_EVICT_INTERVAL_SECONDS: int = 300
+    # Identifies this process's jobs across restarts: must differ between replicas and stay the
+    # same when a replica's container is recreated (set it explicitly, the hostname changes).
+    # Jobs of an instance that never comes back are failed once past their expiry.
+    JOB_INSTANCE_ID: str = socket.gethostname()
+    # Request tracing (services.tracing); TRACE_EXPORT_FILE appends finished spans as JSON lines
+    TRACING_ENABLED: bool = True
+    TRACE_MAX_TRACES: int = 500
+    TRACE_MAX_SPANS_PER_TRACE: int = 2000
+    TRACE_EXPORT_FILE: str = ""
+    # Response compression (services.compression); internal hops favour speed, 0 turns it off
+    COMPRESSION_MIN_SIZE: int = 1024
+    COMPRESSION_LEVEL: int = 1
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,106 @@
+"""
+Offline bulk loader for NSE F&O bhavcopy files into option_bars.
+
+Run from the nse service directory (DB_CONFIG must be set, e.g. via .env):
+
+    python -m db.load_bhavcopy /data/bhavcopy/2024 /data/bhavcopy/fo03MAR2025bhav.csv.zip
+    python -m db.load_bhavcopy /data/bhavcopy --symbols NIFTY,BANKNIFTY --chunk-size 5000
+
+Files are streamed row by row and written in chunks through the multi-row
+upsert, so memory stays bounded by --chunk-size whatever the backfill size.
+Re-loading a file is safe, and columns a layout does not carry (the legacy
+file has no lot size, LTP, previous close, ...) keep whatever an NSE fetch or a
+UDiFF file stored for the same bar. Unless --no-coverage is given, every loaded run of
+consecutive trading days is also recorded in the coverage index, so the API
+stops scraping NSE for those days.
+"""
+import argparse
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from tortoise import Tortoise
+
+from conf import settings
+from services.bhavcopy import iter_bhavcopy_files, read_bhavcopy_file
+from services.option_bars import BAR_KEY
+from services.option_coverage import record_coverage
+from services.trading_calendar import get_trading_calendar
+from services.utils import bulk_upsert
+
+logger = logging.getLogger(__name__)
+
+
+def _trading_day_runs(days) -> List[Tuple]:
+    """Group loaded days into runs with no missing trading day in between."""
+    calendar = get_trading_calendar()
+    runs = []
+    for day in sorted(days):
+        if runs and calendar.next_trading_day(runs[-1][1]) == day:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+    return [tuple(run) for run in runs]
+
+
+async def load(paths: List[str], symbols: List[str], chunk_size: int, with_coverage: bool = True):
+    await Tortoise.init(db_url=settings.DB_CONFIG, modules={"models": ["db.models.nse"]})
+    try:
+        await Tortoise.generate_schemas(safe=True)
+
+        files = iter_bhavcopy_files(paths)
+        logger.info(f"Loading {len(files)} bhavcopy files for {', '.join(symbols)}")
+
+        contract_spans: Dict[tuple, list] = {}  # contract -> [first trade date, last trade date]
+        loaded_days = set()
+        chunk, total = [], 0
+        for path in files:
+            file_rows = 0
+            for bar in read_bhavcopy_file(path, symbols):
+                chunk.append(bar)
+                file_rows += 1
+                loaded_days.add(bar["trade_date"])
+                span = contract_spans.setdefault(tuple(bar[k] for k in BAR_KEY[:4]), [bar["trade_date"]] * 2)
+                span[0], span[1] = min(span[0], bar["trade_date"]), max(span[1], bar["trade_date"])
+                if len(chunk) >= chunk_size:
+                    total += await bulk_upsert("option_bars", chunk, unique_key=BAR_KEY, keep_existing_on_null=True)
+                    chunk = []
+            logger.info(f"{path}: {file_rows} option rows")
+        if chunk:
+            total += await bulk_upsert("option_bars", chunk, unique_key=BAR_KEY, keep_existing_on_null=True)
+        logger.info(f"Upserted {total} bars for {len(contract_spans)} contracts over {len(loaded_days)} trading days")
+
+        if with_coverage and loaded_days:
+            runs = _trading_day_runs(loaded_days)
+            recorded = 0
+            for (symbol, expiry_date, option_type, strike_price), (first, last) in contract_spans.items():
+                for run_start, run_end in runs:
+                    if run_end < first or run_start > last:
+                        continue
+                    # A day file lists every contract that traded, so absent days are confirmed empty.
+                    # Bar counts are only tracked for NSE fetches.
+                    await record_coverage(
+                        symbol, expiry_date, option_type, strike_price, run_start, min(run_end, expiry_date), 0
+                    )
+                    recorded += 1
+            logger.info(f"Recorded {recorded} coverage spans from {len(runs)} runs of trading days")
+    finally:
+        await Tortoise.close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load NSE F&O bhavcopy files into option_bars")
+    parser.add_argument("paths", nargs="+", help="bhavcopy .csv/.zip files or directories holding them")
+    parser.add_argument("--symbols", default=settings.BHAVCOPY_SYMBOLS,
+                        help="comma-separated index symbols to keep (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per upsert batch (default: %(default)s)")
+    parser.add_argument("--no-coverage", action="store_true", help="do not mark loaded days as covered")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    symbols = [symbol.strip().upper() for symbol in args.symbols.split(",") if symbol.strip()]
+    asyncio.run(load(args.paths, symbols, args.chunk_size, with_coverage=not args.no_coverage))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+One-shot migration of the legacy NIFTY / BANKNIFTY / FINNIFTY tables into option_bars.
+
+Run from the nse service directory (DB_CONFIG must be set, e.g. via .env):
+
+    python -m db.migrate_option_bars
+
+Each legacy table is copied with a single INSERT ... SELECT that parses the
+string columns (STR_TO_DATE / CAST) on the database side. Re-running is safe:
+bars that already exist are skipped by the option_bars unique index, and
+unparsable values become NULL instead of aborting the copy (INSERT IGNORE).
+"""
+import asyncio
+import logging
+
+from tortoise import Tortoise
+
+from conf import settings
+
+logger = logging.getLogger(__name__)
+
+BAR_COLUMNS = """
+    symbol, expiry_date, option_type, strike_price, trade_date, instrument,
+    open_price, high_price, low_price, closing_price, last_traded_price, settle_price, prev_close,
+    traded_value, underlying_value, market_lot, open_int, change_in_oi, traded_qty, market_type
+"""
+
+
+def _price(column):
+    return f"CAST(NULLIF(NULLIF({column}, ''), '-') AS DECIMAL(20, 2))"
+
+
+def _count(column):
+    return f"CAST({_price(column)} AS SIGNED)"
+
+
+# NIFTY keeps every NSE field as a string in its FH_* columns
+NIFTY_QUERY = f"""
+INSERT IGNORE INTO option_bars ({BAR_COLUMNS})
+SELECT
+    UPPER(TRIM(FH_SYMBOL)),
+    STR_TO_DATE(FH_EXPIRY_DT, '%d-%b-%Y'),
+    UPPER(TRIM(FH_OPTION_TYPE)),
+    {_price("FH_STRIKE_PRICE")},
+    STR_TO_DATE(FH_TIMESTAMP, '%d-%b-%Y'),
+    COALESCE(FH_INSTRUMENT, 'OPTIDX'),
+    {_price("FH_OPENING_PRICE")}, {_price("FH_TRADE_HIGH_PRICE")}, {_price("FH_TRADE_LOW_PRICE")},
+    {_price("FH_CLOSING_PRICE")}, {_price("FH_LAST_TRADED_PRICE")}, {_price("FH_SETTLE_PRICE")},
+    {_price("FH_PREV_CLS")}, {_price("FH_TOT_TRADED_VAL")}, FH_UNDERLYING_VALUE,
+    {_count("FH_MARKET_LOT")}, {_count("FH_OPEN_INT")}, {_count("FH_CHANGE_IN_OI")}, {_count("FH_TOT_TRADED_QTY")},
+    FH_MARKET_TYPE
+FROM nifty
+WHERE FH_SYMBOL IS NOT NULL AND FH_OPTION_TYPE IS NOT NULL
+AND STR_TO_DATE(FH_EXPIRY_DT, '%d-%b-%Y') IS NOT NULL
+AND STR_TO_DATE(FH_TIMESTAMP, '%d-%b-%Y') IS NOT NULL
+AND {_price("FH_STRIKE_PRICE")} IS NOT NULL
+"""
+
+
+def _typed_table_query(table):
+    # BANKNIFTY / FINNIFTY already have typed columns, only expiry is free text
+    expiry = "COALESCE(STR_TO_DATE(expiry, '%d-%b-%Y'), STR_TO_DATE(expiry, '%Y-%m-%d'))"
+    return f"""
+INSERT IGNORE INTO option_bars ({BAR_COLUMNS})
+SELECT
+    UPPER(TRIM(COALESCE(symbol, '{table.upper()}'))),
+    {expiry},
+    UPPER(TRIM(option_type)),
+    strike_price,
+    `date`,
+    'OPTIDX',
+    `open`, high, low, COALESCE(closing_price, `close`), COALESCE(last_traded_price, ltp), settle_price, prev_cls,
+    tot_traded_val, underlying_value,
+    market_lot, CAST(open_int AS SIGNED), CAST(change_in_oi AS SIGNED), CAST(tot_traded_qty AS SIGNED),
+    NULL
+FROM {table}
+WHERE option_type IS NOT NULL AND strike_price IS NOT NULL AND `date` IS NOT NULL
+AND {expiry} IS NOT NULL
+"""
+
+
+MIGRATIONS = [
+    ("nifty", NIFTY_QUERY),
+    ("banknifty", _typed_table_query("banknifty")),
+    ("finnifty", _typed_table_query("finnifty")),
+]
+
+
+async def migrate():
+    await Tortoise.init(db_url=settings.DB_CONFIG, modules={"models": ["db.models.nse"]})
+    try:
+        # Creates option_bars (and its unique index) if the service has not started yet
+        await Tortoise.generate_schemas(safe=True)
+        connection = Tortoise.get_connection("default")
+        for table, query in MIGRATIONS:
+            try:
+                copied, _ = await connection.execute_query(query)
+                logger.info(f"Copied {copied} bars from {table} into option_bars")
+            except Exception as e:
+                logger.error(f"Could not migrate {table}: {e}")
+    finally:
+        await Tortoise.close_connections()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(migrate())
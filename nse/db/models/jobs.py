@@ -0,0 +1,28 @@
+from tortoise import fields
+from tortoise.models import Model
+
+
+class Jobs(Model):
+    """
+    Long-running requests (volatility runs, strategy simulations) executed by
+    the background worker pool of services.jobs. Finished jobs keep their
+    result until expires_at, after which the eviction task deletes them.
+    """
+    job_id = fields.CharField(max_length=32, pk=True)  # uuid4 hex
+    instance = fields.CharField(max_length=100)  # JOB_INSTANCE_ID of the nse process running the job
+    user_id = fields.CharField(max_length=36, null=True)  # request-user-id of the submitter
+    kind = fields.CharField(max_length=50)
+    status = fields.CharField(max_length=20, default='queued')  # queued, running, succeeded, failed
+    progress = fields.FloatField(default=0)  # percent
+    message = fields.CharField(max_length=255, null=True)
+    params = fields.JSONField(null=True)
+    result = fields.JSONField(null=True)
+    status_code = fields.IntField(null=True)  # HTTP status the synchronous endpoint would have returned
+    created_at = fields.DatetimeField(auto_now_add=True)
+    started_at = fields.DatetimeField(null=True)
+    finished_at = fields.DatetimeField(null=True)
+    expires_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "jobs"
+        ordering = ['-created_at']
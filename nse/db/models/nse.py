@@ -112,6 +112,90 @@ class FINNIFTY(models.Model):
 FINNIFTY_Pydantic = pydantic_model_creator(FINNIFTY, name="FINNIFTY")
 
 
+class OptionBars(models.Model):
+    """
+    Typed daily option bars for every index, one row per contract per trading day.
+
+    The unique index on (symbol, expiry_date, option_type, strike_price, trade_date)
+    doubles as the lookup index: contract point lookups and date ranges are index
+    seeks instead of STR_TO_DATE scans over the FH_* string columns.
+    """
+    id = fields.BigIntField(pk=True)
+    symbol = fields.CharField(max_length=20)
+    expiry_date = fields.DateField()
+    option_type = fields.CharField(max_length=2)  # CE or PE
+    strike_price = fields.DecimalField(max_digits=10, decimal_places=2)
+    trade_date = fields.DateField()
+    instrument = fields.CharField(max_length=20, default="OPTIDX")
+    open_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    high_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    low_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    closing_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    last_traded_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    settle_price = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    prev_close = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    market_lot = fields.IntField(null=True)
+    open_int = fields.BigIntField(null=True)
+    change_in_oi = fields.BigIntField(null=True)
+    traded_qty = fields.BigIntField(null=True)
+    traded_value = fields.DecimalField(max_digits=20, decimal_places=2, null=True)
+    underlying_value = fields.DecimalField(max_digits=12, decimal_places=2, null=True)
+    market_type = fields.CharField(max_length=5, null=True)
+
+    class Meta:
+        table = "option_bars"
+        unique_together = (("symbol", "expiry_date", "option_type", "strike_price", "trade_date"),)
+
+    def __str__(self):
+        return f"{self.trade_date} - {self.closing_price}"
+
+
+class OptionBarCoverage(models.Model):
+    """
+    Date spans of a contract already fetched from NSE into option_bars,
+    including spans NSE confirmed empty. Spans of one contract never overlap:
+    adjacent and overlapping spans are merged when recorded.
+    """
+    id = fields.IntField(pk=True)
+    symbol = fields.CharField(max_length=20)
+    expiry_date = fields.DateField()
+    option_type = fields.CharField(max_length=2)
+    strike_price = fields.DecimalField(max_digits=10, decimal_places=2)
+    from_date = fields.DateField()
+    to_date = fields.DateField()
+    bar_count = fields.IntField(default=0)
+    fetched_at = fields.DatetimeField(auto_now=True)
+
+    class Meta:
+        table = "option_bar_coverage"
+        unique_together = (("symbol", "expiry_date", "option_type", "strike_price", "from_date"),)
+
+    def __str__(self):
+        return f"{self.symbol} {self.strike_price} {self.option_type} {self.from_date} - {self.to_date}"
+
+
+class OptionNegativeCache(models.Model):
+    """
+    Date spans of a contract for which NSE recently returned nothing or failed.
+    Lookups inside a live span skip NSE until expires_at.
+    """
+    id = fields.IntField(pk=True)
+    symbol = fields.CharField(max_length=20)
+    expiry_date = fields.DateField()
+    option_type = fields.CharField(max_length=2)
+    strike_price = fields.DecimalField(max_digits=10, decimal_places=2)
+    from_date = fields.DateField()
+    to_date = fields.DateField()
+    reason = fields.CharField(max_length=20)  # empty or error
+    expires_at = fields.DatetimeField(index=True)
+
+    class Meta:
+        table = "option_negative_cache"
+
+    def __str__(self):
+        return f"{self.symbol} {self.strike_price} {self.option_type} {self.from_date} - {self.to_date} ({self.reason})"
+
+
 # Pydantic model for the API payload
 class FetchDataPayload(BaseModel):
     from_date: str
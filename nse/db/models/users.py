@@ -47,6 +47,26 @@ class UserTransactions(Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.symbol} {self.action} {self.option_type}"
+
+
+class SimulationSnapshots(Model):
+    """
+    End-of-day state of a user's strategy simulation, so a new request can
+    resume from the last valid day instead of replaying every transaction.
+    """
+    id = fields.IntField(pk=True)
+    user = fields.ForeignKeyField('models.Users', related_name='simulation_snapshots')
+    snapshot_date = fields.DateField()
+    txn_digest = fields.CharField(max_length=64)  # Digest of the transactions traded on or before snapshot_date
+    price_digest = fields.CharField(max_length=64, null=True)  # Digest of the closing prices read up to snapshot_date
+    state = fields.JSONField()  # Open FIFO layers per contract and realised P&L to date
+    day = fields.JSONField(null=True)  # Simulation output row for snapshot_date, if there was one
+    created_at = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "simulation_snapshots"
+        unique_together = (("user", "snapshot_date"),)
+        ordering = ['snapshot_date']
     
 
 
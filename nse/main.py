@@ -12,6 +12,12 @@ from routers import users
 # from routers import test2
 from routers import option_performance
 from routers import volatility
+from routers import jobs
+from routers import traces
+from services.nse_service import get_nse_client, close_nse_client
+from services.jobs import job_manager
+from services.compression import CompressionMiddleware
+from services.tracing import TracingMiddleware
 
 app = FastAPI(
     title="NSE Derivatives API",
@@ -27,21 +33,47 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(TracingMiddleware, service="nse", exclude=("/api/v1_0/traces",))
 
 try:
     register_tortoise(
         app,
         db_url=os.environ.get('DB_CONFIG'),
-        modules={'models': ['db.models.nse','db.models.users','db.models.volatility']},
+        modules={'models': ['db.models.nse','db.models.users','db.models.volatility','db.models.jobs']},
         generate_schemas=True,
         add_exception_handlers=True,
     )
 except Exception as e:
     print(f"Failed to connect to the database: {e}")
 
+@app.on_event("startup")
+async def start_nse_client():
+    # One pooled NSE session (and cookie jar) for the whole application
+    get_nse_client()
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    # registered after register_tortoise's startup hook, so the database is up
+    await job_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_nse_client():
+    await close_nse_client()
+
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    await job_manager.stop()
+
+
 app.include_router(nse.router)
 app.include_router(users.router)
 # app.include_router(test.router)
 # app.include_router(test2.router)
 app.include_router(option_performance.router)
 app.include_router(volatility.router)
+app.include_router(jobs.router)
+app.include_router(traces.router)
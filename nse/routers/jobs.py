@@ -0,0 +1,106 @@
+from fastapi import APIRouter, Header, HTTPException, Response, status
+
+from routers.option_performance import strategy_simulation
+from routers.volatility import VolatilityRequest, calculate_volatility_api
+from services.fast_json import fast_json
+from services.jobs import FINISHED, SUCCEEDED, JobQueueFull, job_manager
+
+router = APIRouter()
+
+
+# jobs store plain results, so they call the endpoints without @fast_json
+async def _run_volatility(params: dict, user_id: str):
+    response = Response()
+    try:
+        result = await calculate_volatility_api.__wrapped__(
+            payload=VolatilityRequest(**params),
+            response=response,
+            request=None,
+            request_user_id=user_id,
+        )
+    except HTTPException as e:
+        return {"detail": e.detail}, e.status_code
+    return result, response.status_code
+
+
+async def _run_strategy_simulation(params: dict, user_id: str):
+    response = Response()
+    try:
+        result = await strategy_simulation.__wrapped__(request=None, response=response, request_user_id=user_id)
+    except HTTPException as e:
+        return {"detail": e.detail}, e.status_code
+    return result, response.status_code
+
+
+def _job_status(job) -> dict:
+    return {
+        "job_id": job.job_id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "expires_at": job.expires_at if job.status in FINISHED else None,
+        "status_url": f"/api/v1_0/jobs/{job.job_id}",
+        "result_url": f"/api/v1_0/jobs/{job.job_id}/result",
+    }
+
+
+async def _submit(kind: str, runner, params: dict, request_user_id: str, response: Response) -> dict:
+    try:
+        job = await job_manager.submit(kind, runner, params, request_user_id)
+    except JobQueueFull as e:
+        # 429 rather than 503: a full queue is overload, not an unavailable replica
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Too many jobs waiting, try again later ({e})",
+            headers={"Retry-After": "30"},
+        )
+    response.headers["Location"] = f"/api/v1_0/jobs/{job.job_id}"
+    return _job_status(job)
+
+
+@router.post("/api/v1_0/jobs/volatility", status_code=status.HTTP_202_ACCEPTED)
+async def submit_volatility_job(
+    payload: VolatilityRequest,
+    response: Response,
+    request_user_id: str = Header(None)
+):
+    """Same work as POST /api/v1_0/fyres/volatility, run in the background."""
+    return await _submit("volatility", _run_volatility, payload.dict(), request_user_id, response)
+
+
+@router.post("/api/v1_0/jobs/strategy_simulation", status_code=status.HTTP_202_ACCEPTED)
+async def submit_strategy_simulation_job(
+    response: Response,
+    request_user_id: str = Header(None)
+):
+    """Same work as GET /api/v1_0/strategy/simulation, run in the background."""
+    return await _submit("strategy_simulation", _run_strategy_simulation, {}, request_user_id, response)
+
+
+@router.get("/api/v1_0/jobs/{job_id}", status_code=status.HTTP_200_OK)
+async def job_status(job_id: str, request_user_id: str = Header(None)):
+    job = await job_manager.get(job_id, request_user_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found or expired")
+    return _job_status(job)
+
+
+@router.get("/api/v1_0/jobs/{job_id}/result", status_code=status.HTTP_200_OK)
+@fast_json
+async def job_result(job_id: str, response: Response, request_user_id: str = Header(None)):
+    """
+    The job's result with the status code the synchronous endpoint would have
+    returned, or 202 with the job status while it is still queued or running.
+    """
+    job = await job_manager.get(job_id, request_user_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found or expired")
+    if job.status not in FINISHED:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return _job_status(job)
+    response.status_code = job.status_code or (status.HTTP_200_OK if job.status == SUCCEEDED else 500)
+    return job.result
@@ -4,8 +4,8 @@ from db.models.users import *
 from typing import List
 import uuid
 from datetime import datetime, timedelta
-from services.nse_service import NSE
-from db.models.nse import NIFTY
+from services.nse_service import load_option_bars
+from services.option_bars import bar_to_nse_record
 
 from auth  import generate_access_token
 from services.utils import execute_native_query
@@ -114,17 +114,18 @@ async def create_transection(trans_payload: TransactionCreate,
             detail=detail
         )
 
-    # Fetch entry price from NSE
+    # Fetch entry price from the option_bars cache, pulling only uncovered days from NSE
     try:
-        async with NSE(timeout=20) as nse:
-            nse_data = await nse.get_historical_data(
-                symbol=trans_payload.symbol,
-                from_date=trade_date_obj,
-                to_date=expiry_date_obj,
-                expiry_date=expiry_date_obj,
-                option_type=trans_payload.option_type,
-                strike_price=trans_payload.strike_price
-            )
+        bars, _ = await load_option_bars(
+            symbol=trans_payload.symbol,
+            from_date=trade_date_obj,
+            to_date=expiry_date_obj,
+            expiry_date=expiry_date_obj,
+            option_type=trans_payload.option_type,
+            strike_price=trans_payload.strike_price,
+            timeout=20
+        )
+        nse_data = [bar_to_nse_record(bar) for bar in bars]
     except Exception as e:
         detail = f"Exception while fetching data from NSE: {str(e)}"
         print(f"create_transection error: {detail}")
@@ -144,51 +145,6 @@ async def create_transection(trans_payload: TransactionCreate,
             detail=detail
         )
 
-    # Insert NIFTY records
-    try:
-        for record in nse_data:
-            exists = await NIFTY.filter(
-                FH_SYMBOL=record.get("FH_SYMBOL"),
-                FH_EXPIRY_DT=record.get("FH_EXPIRY_DT"),
-                FH_OPTION_TYPE=record.get("FH_OPTION_TYPE"),
-                FH_STRIKE_PRICE=record.get("FH_STRIKE_PRICE"),
-                FH_TIMESTAMP=record.get("FH_TIMESTAMP")
-            ).exists()
-            if exists:
-                continue  # Skip duplicates
-
-            await NIFTY.create(
-                FH_EXPIRY_DT=record.get("FH_EXPIRY_DT"),
-                FH_INSTRUMENT=record.get("FH_INSTRUMENT"),
-                FH_OPTION_TYPE=record.get("FH_OPTION_TYPE"),
-                FH_STRIKE_PRICE=record.get("FH_STRIKE_PRICE"),
-                FH_SYMBOL=record.get("FH_SYMBOL"),
-                TIMESTAMP=record.get("TIMESTAMP"),
-                FH_CHANGE_IN_OI=record.get("FH_CHANGE_IN_OI"),
-                FH_CLOSING_PRICE=record.get("FH_CLOSING_PRICE"),
-                FH_LAST_TRADED_PRICE=record.get("FH_LAST_TRADED_PRICE"),
-                FH_MARKET_LOT=record.get("FH_MARKET_LOT"),
-                FH_MARKET_TYPE=record.get("FH_MARKET_TYPE"),
-                FH_OPENING_PRICE=record.get("FH_OPENING_PRICE"),
-                FH_OPEN_INT=record.get("FH_OPEN_INT"),
-                FH_PREV_CLS=record.get("FH_PREV_CLS"),
-                FH_SETTLE_PRICE=record.get("FH_SETTLE_PRICE"),
-                FH_TIMESTAMP=record.get("FH_TIMESTAMP"),
-                FH_TOT_TRADED_QTY=record.get("FH_TOT_TRADED_QTY"),
-                FH_TOT_TRADED_VAL=record.get("FH_TOT_TRADED_VAL"),
-                FH_TRADE_HIGH_PRICE=record.get("FH_TRADE_HIGH_PRICE"),
-                FH_TRADE_LOW_PRICE=record.get("FH_TRADE_LOW_PRICE"),
-                FH_UNDERLYING_VALUE=record.get("FH_UNDERLYING_VALUE"),
-            )
-    except Exception as e:
-        detail = f"Exception while inserting NIFTY records: {str(e)}"
-        print(f"create_transection error: {detail}")
-        print(traceback.format_exc())
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=detail
-        )
-
     # Find the record for the trade date
     entry_price = None
     market_lot = None
@@ -200,7 +156,7 @@ async def create_transection(trans_payload: TransactionCreate,
                 except Exception:
                     continue
                 if record_date == trade_date_obj:
-                    entry_price = float(record.get('FH_CLOSING_PRICE', 0))
+                    entry_price = float(record.get('FH_CLOSING_PRICE') or 0)
                     market_lot = record.get('FH_MARKET_LOT', None)
                     break
     except Exception as e:
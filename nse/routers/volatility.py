@@ -6,6 +6,9 @@ import pandas as pd
 from typing import Optional, List
 from services.utils import execute_native_query
 from routers.users import create_transection  # Add this import if not already present
+from services.jobs import report_progress
+from services.tracing import span
+from services.fast_json import fast_json
 import asyncio
 import traceback
 
@@ -535,6 +538,7 @@ async def calculate_volatility_api(payload: VolatilityRequest,
         '''
 
 @router.post("/api/v1_0/fyres/volatility", status_code=status.HTTP_200_OK)
+@fast_json
 async def calculate_volatility_api(payload: VolatilityRequest,
                                    response: Response,
                                    request: Request,
@@ -579,12 +583,14 @@ async def calculate_volatility_api(payload: VolatilityRequest,
         transactions_created = []  # To track created transactions
 
         # Process each month sequentially
-        for calc_date in calculation_dates:
+        for month_no, calc_date in enumerate(calculation_dates):
+            await report_progress(100 * month_no / len(calculation_dates), f"Month {calc_date.strftime('%Y-%m')}")
             try:
                 #print(f"Debug: Processing month starting {calc_date.date()}")
 
                 # Calculate rolling volatility for the current month
-                monthly_result = calculate_rolling_volatility(df, calc_date)
+                with span("volatility.rolling_volatility", month=calc_date.strftime('%Y-%m')):
+                    monthly_result = calculate_rolling_volatility(df, calc_date)
                 stats = monthly_result["volatility_stats"]
                 spot = stats["spot"]
 
@@ -820,6 +826,7 @@ async def calculate_volatility_api(payload: VolatilityRequest,
 
 
 @router.get("/api/v1_0/fyres/volatility_of_month/{month}/{year}/{symbol}", status_code=status.HTTP_200_OK)
+@fast_json
 async def volatility_of_month(
     month: str,
     year: str,
@@ -0,0 +1,154 @@
+"""
+Streaming parser for NSE F&O bhavcopy files (one file per trading day).
+
+Both published layouts are understood:
+
+* legacy   fo03MAR2025bhav.csv[.zip]   INSTRUMENT, SYMBOL, EXPIRY_DT, STRIKE_PR, ...
+* UDiFF    BhavCopy_NSE_FO_0_0_0_20250303_F_0000.csv[.zip]   FinInstrmTp, TckrSymb, XpryDt, ...
+
+Rows are yielded one at a time as option_bars column dicts, so a file is never
+held in memory as a whole. Only index options (OPTIDX / IDO) of the requested
+symbols are kept. No database access happens here.
+"""
+import csv
+import io
+import logging
+import os
+import zipfile
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+LEGACY_DATE_FORMAT = "%d-%b-%Y"
+UDIFF_DATE_FORMAT = "%Y-%m-%d"
+
+
+def _decimal(value) -> Optional[Decimal]:
+    if value is None:
+        return None
+    value = value.strip()
+    if not value or value == "-":
+        return None
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def _int(value) -> Optional[int]:
+    number = _decimal(value)
+    return int(number) if number is not None else None
+
+
+def _legacy_row_to_bar(row: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if row.get("INSTRUMENT", "").strip() != "OPTIDX":
+        return None
+    value_in_lakh = _decimal(row.get("VAL_INLAKH"))
+    return {
+        "symbol": row["SYMBOL"].strip().upper(),
+        "expiry_date": datetime.strptime(row["EXPIRY_DT"].strip(), LEGACY_DATE_FORMAT).date(),
+        "option_type": row["OPTION_TYP"].strip().upper(),
+        "strike_price": _decimal(row["STRIKE_PR"]),
+        "trade_date": datetime.strptime(row["TIMESTAMP"].strip(), LEGACY_DATE_FORMAT).date(),
+        "instrument": "OPTIDX",
+        "open_price": _decimal(row.get("OPEN")),
+        "high_price": _decimal(row.get("HIGH")),
+        "low_price": _decimal(row.get("LOW")),
+        "closing_price": _decimal(row.get("CLOSE")),
+        "last_traded_price": None,
+        "settle_price": _decimal(row.get("SETTLE_PR")),
+        "prev_close": None,
+        "traded_value": value_in_lakh * 100000 if value_in_lakh is not None else None,
+        "underlying_value": None,
+        # The legacy layout has no lot size, so quantity cannot be derived from CONTRACTS
+        "market_lot": None,
+        "open_int": _int(row.get("OPEN_INT")),
+        "change_in_oi": _int(row.get("CHG_IN_OI")),
+        "traded_qty": None,
+        "market_type": None,
+    }
+
+
+def _udiff_row_to_bar(row: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    if row.get("FinInstrmTp", "").strip() != "IDO":
+        return None
+    return {
+        "symbol": row["TckrSymb"].strip().upper(),
+        "expiry_date": datetime.strptime(row["XpryDt"].strip(), UDIFF_DATE_FORMAT).date(),
+        "option_type": row["OptnTp"].strip().upper(),
+        "strike_price": _decimal(row["StrkPric"]),
+        "trade_date": datetime.strptime(row["TradDt"].strip(), UDIFF_DATE_FORMAT).date(),
+        "instrument": "OPTIDX",
+        "open_price": _decimal(row.get("OpnPric")),
+        "high_price": _decimal(row.get("HghPric")),
+        "low_price": _decimal(row.get("LwPric")),
+        "closing_price": _decimal(row.get("ClsPric")),
+        "last_traded_price": _decimal(row.get("LastPric")),
+        "settle_price": _decimal(row.get("SttlmPric")),
+        "prev_close": _decimal(row.get("PrvsClsgPric")),
+        "traded_value": _decimal(row.get("TtlTrfVal")),
+        "underlying_value": _decimal(row.get("UndrlygPric")),
+        "market_lot": _int(row.get("NewBrdLotQty")),
+        "open_int": _int(row.get("OpnIntrst")),
+        "change_in_oi": _int(row.get("ChngInOpnIntrst")),
+        "traded_qty": _int(row.get("TtlTradgVol")),
+        "market_type": None,
+    }
+
+
+def parse_bhavcopy_rows(lines: Iterable[str], symbols: Iterable[str], source: str = "<stream>") -> Iterator[Dict[str, Any]]:
+    """Yield option_bars rows for the index options of symbols in one bhavcopy CSV."""
+    wanted = {symbol.strip().upper() for symbol in symbols}
+    reader = csv.DictReader(lines)
+    header = [name.strip() for name in (reader.fieldnames or [])]
+    reader.fieldnames = header
+    if "FinInstrmTp" in header:
+        to_bar, symbol_column = _udiff_row_to_bar, "TckrSymb"
+    elif "INSTRUMENT" in header:
+        to_bar, symbol_column = _legacy_row_to_bar, "SYMBOL"
+    else:
+        logger.warning(f"Skipping {source}: not an F&O bhavcopy (header {header[:5]})")
+        return
+
+    for line_no, row in enumerate(reader, start=2):
+        if (row.get(symbol_column) or "").strip().upper() not in wanted:
+            continue
+        try:
+            bar = to_bar(row)
+        except (KeyError, ValueError, AttributeError) as e:
+            logger.warning(f"Skipping {source}:{line_no}: {e}")
+            continue
+        if bar is not None and bar["strike_price"] is not None:
+            yield bar
+
+
+def iter_bhavcopy_files(paths: Iterable[str]) -> List[str]:
+    """Expand files and directories into a sorted list of .csv / .zip bhavcopy files."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith((".csv", ".zip"))
+            )
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+def read_bhavcopy_file(path: str, symbols: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Stream option_bars rows out of a bhavcopy .csv or a .zip holding one or more CSVs."""
+    symbols = list(symbols)
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if not member.lower().endswith(".csv"):
+                    continue
+                with archive.open(member) as raw:
+                    text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+                    yield from parse_bhavcopy_rows(text, symbols, source=f"{path}:{member}")
+    else:
+        with open(path, encoding="utf-8-sig", newline="") as text:
+            yield from parse_bhavcopy_rows(text, symbols, source=path)
@@ -16,6 +16,8 @@ import json
 import math
 import calendar
 from db.models.volatility import IndexHistoricalData
+from services.trading_calendar import get_trading_calendar
+from services.tracing import span
 
 
 
@@ -143,7 +145,8 @@ def fetch_historical_data(symbol: str, end_date_str: str, years_of_data: int, in
     """
     try: 
         print("Debug: Starting fetch_historical_data")
-        access_token = get_token()
+        with span("fyers.login", "http"):
+            access_token = get_token()
 
         print(f"Debug: Got access token: {access_token[:20]}...")
 
@@ -207,7 +210,9 @@ def fetch_historical_data(symbol: str, end_date_str: str, years_of_data: int, in
             print(f"Fetching data for '{symbol}' from {payload['range_from']} to {payload['range_to']}")
             #response = fyers.history(data=payload) # Pass payload with keyword 'data='
             try:
-                response = fyers.history(data=payload)
+                with span("fyers.history", "http", symbol=symbol, range_from=payload["range_from"],
+                          range_to=payload["range_to"]):
+                    response = fyers.history(data=payload)
                 print(f"Debug: API response status: {response.get('s', 'no status')}")
             except Exception as e:
                 print(f"Debug: Error calling fyers.history: {str(e)}")
@@ -375,12 +380,10 @@ def get_nearest_strike(price: float, interval: int = 100, method: str = "ceil")
 def get_next_trading_day(last_date: datetime) -> datetime:
     """
     Calculates the next trading day after a given date.
-    A "trading day" is defined here simply as a weekday (Monday to Friday).
-    It does not account for public holidays.
+    Weekends and NSE holidays are skipped using the exchange trading calendar.
     """
-    next_day = last_date + timedelta(days=1)
-    while next_day.weekday() >= 5:  # Skip Saturday/Sunday
-        next_day += timedelta(days=1)
+    next_trading_date = get_trading_calendar().next_trading_day(last_date)
+    next_day = last_date + timedelta(days=(next_trading_date - last_date.date()).days)
 
     print("Next trading day: ", next_day)    
     return next_day
@@ -414,10 +417,9 @@ def get_monthly_expiry(date: datetime) -> datetime:
     # 3. Create a datetime object for the last calendar day of the month
     last_date = datetime(year, month, last_day)
 
-    # Backtrack to last Thursday
-    while last_date.weekday() != 3:  # Thursday = 3
-        last_date -= timedelta(days=1) # Go back one day as we already at end of the month
-    return last_date
+    # Backtrack to last Thursday, then to the previous trading day if the exchange is closed
+    expiry = get_trading_calendar().expiry_date(year, month)
+    return last_date - timedelta(days=(last_date.date() - expiry).days)
 
 
 
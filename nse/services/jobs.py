@@ -0,0 +1,206 @@
+"""
+Background job subsystem for requests that run for minutes.
+
+A job is submitted with a runner coroutine, queued on a bounded queue and
+executed by a fixed pool of worker tasks, so at most JOB_WORKERS long runs
+share the event loop at a time. State, progress and the final result are
+kept in the jobs table (db.models.jobs.Jobs) and evicted JOB_RESULT_TTL_SECONDS
+after the job finished. A job still queued or running at its submit-time
+expires_at is assumed lost with the instance that held it (e.g. a replaced
+container) and is failed. Long-running code reports progress through
+report_progress(), which is a no-op outside a job.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from conf import settings
+from db.models.jobs import Jobs
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+# runner(params, user_id) -> (result, status_code)
+JobRunner = Callable[[dict, Optional[str]], Awaitable[tuple]]
+
+ABANDONED_MESSAGE = "Job did not finish before it expired; the instance running it is gone"
+
+# progress is written to the jobs table at most this often per job
+PROGRESS_WRITE_INTERVAL_SECONDS = 1.0
+
+_current_job: contextvars.ContextVar = contextvars.ContextVar("current_job", default=None)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _json_safe(value):
+    """jsonable_encoder output with NaN/inf replaced by None, which MySQL JSON rejects."""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {key: _json_safe(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_json_safe(item) for item in value]
+    return value
+
+
+class _JobContext:
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.progress = 0.0
+        self._written_at = 0.0
+
+    async def update(self, progress: float, message: Optional[str]):
+        self.progress = max(self.progress, min(progress, 100.0))
+        now = time.monotonic()
+        if now - self._written_at < PROGRESS_WRITE_INTERVAL_SECONDS:
+            return
+        self._written_at = now
+        fields = {"progress": round(self.progress, 1)}
+        if message is not None:
+            fields["message"] = message[:255]
+        await Jobs.filter(job_id=self.job_id).update(**fields)
+
+
+async def report_progress(percent: float, message: Optional[str] = None):
+    """Record the progress of the job running in this task; does nothing outside a job."""
+    context = _current_job.get()
+    if context is None:
+        return
+    try:
+        await context.update(percent, message)
+    except Exception as e:
+        # progress is informative only, never let it break the job
+        logger.warning(f"Could not record progress of job {context.job_id}: {e}")
+
+
+async def _fail_unfinished(reason: str, **filters) -> int:
+    """Mark the queued or running jobs matching filters as failed; their result stays readable for the TTL."""
+    now = datetime.utcnow()
+    return await Jobs.filter(status__in=[QUEUED, RUNNING], **filters).update(
+        status=FAILED,
+        status_code=500,
+        result={"error": reason},
+        finished_at=now,
+        expires_at=now + timedelta(seconds=settings.JOB_RESULT_TTL_SECONDS),
+    )
+
+
+class JobManager:
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+        self._evictor: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=settings.JOB_QUEUE_SIZE)
+        # jobs this instance held before a restart can never finish, their runners are gone
+        interrupted = await _fail_unfinished(
+            "Job was interrupted by a service restart", instance=settings.JOB_INSTANCE_ID
+        )
+        if interrupted:
+            logger.warning(f"Marked {interrupted} unfinished jobs as failed")
+        self._workers = [asyncio.ensure_future(self._work(n)) for n in range(settings.JOB_WORKERS)]
+        self._evictor = asyncio.ensure_future(self._evict_periodically())
+
+    async def stop(self):
+        tasks = self._workers + ([self._evictor] if self._evictor else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._evictor = [], None
+
+    async def submit(self, kind: str, runner: JobRunner, params: dict, user_id: Optional[str]) -> Jobs:
+        if self._queue is None:
+            raise RuntimeError("JobManager.start() has not been awaited")
+        if self._queue.full():
+            raise JobQueueFull(f"{self._queue.qsize()} jobs are already waiting")
+        job = await Jobs.create(
+            job_id=uuid.uuid4().hex,
+            instance=settings.JOB_INSTANCE_ID,
+            user_id=user_id,
+            kind=kind,
+            status=QUEUED,
+            params=_json_safe(jsonable_encoder(params)),
+            expires_at=datetime.utcnow() + timedelta(seconds=settings.JOB_RESULT_TTL_SECONDS),
+        )
+        self._queue.put_nowait((job.job_id, runner, params, user_id))
+        logger.info(f"Queued {kind} job {job.job_id} for user {user_id}")
+        return job
+
+    async def get(self, job_id: str, user_id: Optional[str]) -> Optional[Jobs]:
+        """
+        The job, if it belongs to user_id and, once finished, has not expired
+        yet. An unfinished job past its expiry is failed first.
+        """
+        job = await Jobs.filter(job_id=job_id, user_id=user_id).first()
+        if job is None:
+            return None
+        if job.expires_at <= datetime.utcnow():
+            if job.status in FINISHED:
+                return None
+            await _fail_unfinished(ABANDONED_MESSAGE, job_id=job_id)
+            job = await Jobs.filter(job_id=job_id).first()
+        return job
+
+    async def _work(self, worker_no: int):
+        while True:
+            job_id, runner, params, user_id = await self._queue.get()
+            try:
+                await self._run(job_id, runner, params, user_id)
+            except Exception:
+                logger.exception(f"Worker {worker_no} could not record the outcome of job {job_id}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str, runner: JobRunner, params: dict, user_id: Optional[str]):
+        await Jobs.filter(job_id=job_id).update(status=RUNNING, started_at=datetime.utcnow())
+        token = _current_job.set(_JobContext(job_id))
+        try:
+            result, status_code = await runner(params, user_id)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            result, status_code = {"error": str(e)}, 500
+        finally:
+            _current_job.reset(token)
+
+        status = SUCCEEDED if status_code < 400 else FAILED
+        finished_at = datetime.utcnow()
+        outcome = {
+            "status": status,
+            "status_code": status_code,
+            "result": _json_safe(jsonable_encoder(result)),
+            "finished_at": finished_at,
+            "expires_at": finished_at + timedelta(seconds=settings.JOB_RESULT_TTL_SECONDS),
+        }
+        if status == SUCCEEDED:
+            outcome["progress"] = 100
+        await Jobs.filter(job_id=job_id).update(**outcome)
+        logger.info(f"Job {job_id} {status} with status {status_code}")
+
+    async def _evict_periodically(self):
+        while True:
+            await asyncio.sleep(settings.JOB_EVICT_INTERVAL_SECONDS)
+            try:
+                abandoned = await _fail_unfinished(ABANDONED_MESSAGE, expires_at__lte=datetime.utcnow())
+                if abandoned:
+                    logger.warning(f"Marked {abandoned} jobs unfinished past their expiry as failed")
+                evicted = await Jobs.filter(status__in=FINISHED, expires_at__lte=datetime.utcnow()).delete()
+                if evicted:
+                    logger.info(f"Evicted {evicted} expired jobs")
+            except Exception as e:
+                logger.warning(f"Job eviction failed: {e}")
+
+
+job_manager = JobManager()
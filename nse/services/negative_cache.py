@@ -0,0 +1,57 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Tuple
+
+from db.models.nse import OptionNegativeCache
+from services.option_coverage import contract_filter
+
+logger = logging.getLogger(__name__)
+
+# (from_date, to_date, expires_at)
+NegativeSpan = Tuple[date, date, datetime]
+
+
+class NegativeCache:
+    """
+    Known-empty or failing NSE lookups, persisted in option_negative_cache and
+    mirrored in memory per contract.
+
+    A contract's live spans are read from the database once per process, after
+    which covers() is answered from memory; add() writes through to both.
+    """
+
+    def __init__(self):
+        self._spans: Dict[tuple, List[NegativeSpan]] = {}
+
+    async def _contract_spans(self, contract: dict) -> List[NegativeSpan]:
+        key = tuple(contract.values())
+        spans = self._spans.get(key)
+        if spans is None:
+            now = datetime.utcnow()
+            await OptionNegativeCache.filter(**contract, expires_at__lte=now).delete()
+            rows = await OptionNegativeCache.filter(**contract).values_list("from_date", "to_date", "expires_at")
+            spans = self._spans[key] = [(start, end, expires_at) for start, end, expires_at in rows]
+        return spans
+
+    async def covers(self, symbol, expiry_date, option_type, strike_price, from_date: date, to_date: date) -> bool:
+        """True when a live negative span contains the whole [from_date, to_date] range."""
+        spans = await self._contract_spans(contract_filter(symbol, expiry_date, option_type, strike_price))
+        now = datetime.utcnow()
+        spans[:] = [span for span in spans if span[2] > now]
+        return any(start <= from_date and to_date <= end for start, end, _ in spans)
+
+    async def add(self, symbol, expiry_date, option_type, strike_price, from_date: date, to_date: date,
+                  reason: str, ttl_seconds: int):
+        if ttl_seconds <= 0:
+            return
+        contract = contract_filter(symbol, expiry_date, option_type, strike_price)
+        expires_at = datetime.utcnow() + timedelta(seconds=ttl_seconds)
+        spans = await self._contract_spans(contract)
+        await OptionNegativeCache.create(
+            **contract, from_date=from_date, to_date=to_date, reason=reason, expires_at=expires_at
+        )
+        spans.append((from_date, to_date, expires_at))
+        logger.info(f"Negative-cached {symbol} {strike_price} {option_type} {from_date} to {to_date} ({reason}) for {ttl_seconds}s")
+
+
+negative_cache = NegativeCache()
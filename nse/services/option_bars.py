@@ -0,0 +1,133 @@
+import logging
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, Iterable, List, Optional
+
+from services.utils import bulk_upsert, execute_native_query
+
+logger = logging.getLogger(__name__)
+
+NSE_DATE_FORMAT = "%d-%b-%Y"
+
+# option_bars column -> NSE foCPV field
+PRICE_FIELDS = {
+    "open_price": "FH_OPENING_PRICE",
+    "high_price": "FH_TRADE_HIGH_PRICE",
+    "low_price": "FH_TRADE_LOW_PRICE",
+    "closing_price": "FH_CLOSING_PRICE",
+    "last_traded_price": "FH_LAST_TRADED_PRICE",
+    "settle_price": "FH_SETTLE_PRICE",
+    "prev_close": "FH_PREV_CLS",
+    "traded_value": "FH_TOT_TRADED_VAL",
+    "underlying_value": "FH_UNDERLYING_VALUE",
+}
+COUNT_FIELDS = {
+    "market_lot": "FH_MARKET_LOT",
+    "open_int": "FH_OPEN_INT",
+    "change_in_oi": "FH_CHANGE_IN_OI",
+    "traded_qty": "FH_TOT_TRADED_QTY",
+}
+
+# Mirrors the OptionBars unique index
+BAR_KEY = ("symbol", "expiry_date", "option_type", "strike_price", "trade_date")
+
+BAR_COLUMNS = [
+    "symbol", "expiry_date", "option_type", "strike_price", "trade_date", "instrument",
+    *PRICE_FIELDS, *COUNT_FIELDS, "market_type",
+]
+
+
+def _to_decimal(value) -> Optional[Decimal]:
+    if value is None or value == "" or value == "-":
+        return None
+    try:
+        return Decimal(str(value).replace(",", ""))
+    except InvalidOperation:
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    number = _to_decimal(value)
+    return int(number) if number is not None else None
+
+
+def _to_float(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def nse_record_to_bar(record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Convert an NSE foCPV record (FH_* strings) into option_bars column values.
+    Returns None when the contract key or trade date cannot be parsed.
+    """
+    try:
+        bar = {
+            "symbol": record["FH_SYMBOL"].strip().upper(),
+            "expiry_date": datetime.strptime(record["FH_EXPIRY_DT"], NSE_DATE_FORMAT).date(),
+            "option_type": record["FH_OPTION_TYPE"].strip().upper(),
+            "strike_price": _to_decimal(record["FH_STRIKE_PRICE"]),
+            "trade_date": datetime.strptime(record["FH_TIMESTAMP"], NSE_DATE_FORMAT).date(),
+            "instrument": record.get("FH_INSTRUMENT") or "OPTIDX",
+            "market_type": record.get("FH_MARKET_TYPE"),
+        }
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        logger.warning(f"Skipping unparsable NSE record: {e}")
+        return None
+    if bar["strike_price"] is None:
+        return None
+    for column, field in PRICE_FIELDS.items():
+        bar[column] = _to_decimal(record.get(field))
+    for column, field in COUNT_FIELDS.items():
+        bar[column] = _to_int(record.get(field))
+    return bar
+
+
+def bar_to_nse_record(bar: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert an option_bars row back into the NSE foCPV shape the API returns."""
+    record = {
+        "FH_TIMESTAMP": bar["trade_date"].strftime(NSE_DATE_FORMAT),
+        "FH_SYMBOL": bar["symbol"],
+        "FH_INSTRUMENT": bar["instrument"],
+        "FH_STRIKE_PRICE": float(bar["strike_price"]),
+        "FH_EXPIRY_DT": bar["expiry_date"].strftime(NSE_DATE_FORMAT),
+        "FH_OPTION_TYPE": bar["option_type"],
+        "FH_MARKET_TYPE": bar["market_type"],
+        "TIMESTAMP": bar["trade_date"].isoformat(),
+    }
+    for column, field in PRICE_FIELDS.items():
+        record[field] = _to_float(bar[column])
+    for column, field in COUNT_FIELDS.items():
+        record[field] = bar[column]
+    return record
+
+
+async def fetch_option_bars(
+    symbol: str,
+    expiry_date: date,
+    option_type: str,
+    strike_price,
+    from_date: date,
+    to_date: date
+) -> List[Dict[str, Any]]:
+    """Bars of one contract between from_date and to_date, oldest first (one index range scan)."""
+    query = f"""
+    SELECT {", ".join(BAR_COLUMNS)}
+    FROM option_bars
+    WHERE symbol = %s AND expiry_date = %s AND option_type = %s AND strike_price = %s
+    AND trade_date BETWEEN %s AND %s
+    ORDER BY trade_date
+    """
+    rows = await execute_native_query(
+        query, [symbol.upper(), expiry_date, option_type.upper(), _to_decimal(strike_price), from_date, to_date]
+    )
+    return list(rows or [])
+
+
+async def store_option_bars(records: Iterable[Dict[str, Any]]) -> int:
+    """
+    Store NSE foCPV records into option_bars in one multi-row upsert.
+    Bars that already exist are refreshed with the latest values.
+    Returns the number of bars written.
+    """
+    bars = [bar for bar in map(nse_record_to_bar, records) if bar is not None]
+    return await bulk_upsert("option_bars", bars, unique_key=BAR_KEY)
@@ -0,0 +1,81 @@
+import logging
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List, Tuple
+
+from tortoise.transactions import in_transaction
+
+from db.models.nse import OptionBarCoverage
+
+logger = logging.getLogger(__name__)
+
+DateRange = Tuple[date, date]
+
+ONE_DAY = timedelta(days=1)
+
+
+def contract_filter(symbol, expiry_date, option_type, strike_price) -> dict:
+    """Normalised contract key columns shared by the option cache tables."""
+    return {
+        "symbol": symbol.upper(),
+        "expiry_date": expiry_date,
+        "option_type": option_type.upper(),
+        "strike_price": Decimal(str(strike_price)),
+    }
+
+
+def missing_ranges(covered: List[DateRange], from_date: date, to_date: date) -> List[DateRange]:
+    """Sub-ranges of [from_date, to_date] not inside any covered span (spans sorted by start)."""
+    missing = []
+    cursor = from_date
+    for start, end in covered:
+        if end < cursor:
+            continue
+        if start > to_date:
+            break
+        if start > cursor:
+            missing.append((cursor, start - ONE_DAY))
+        cursor = max(cursor, end + ONE_DAY)
+        if cursor > to_date:
+            break
+    if cursor <= to_date:
+        missing.append((cursor, to_date))
+    return missing
+
+
+async def get_coverage(symbol, expiry_date, option_type, strike_price, from_date: date, to_date: date) -> List[DateRange]:
+    """Covered spans of a contract that intersect [from_date, to_date], sorted by start."""
+    rows = await OptionBarCoverage.filter(
+        **contract_filter(symbol, expiry_date, option_type, strike_price),
+        from_date__lte=to_date,
+        to_date__gte=from_date,
+    ).order_by("from_date").values_list("from_date", "to_date")
+    return [(start, end) for start, end in rows]
+
+
+async def record_coverage(symbol, expiry_date, option_type, strike_price, from_date: date, to_date: date, bar_count: int):
+    """
+    Mark [from_date, to_date] of a contract as fetched, merging it with any
+    overlapping or adjacent span. Days from today onwards are never recorded,
+    since NSE may still publish bars for them.
+    """
+    to_date = min(to_date, date.today() - ONE_DAY)
+    if to_date < from_date:
+        return
+
+    contract = contract_filter(symbol, expiry_date, option_type, strike_price)
+    async with in_transaction():
+        touching = await OptionBarCoverage.filter(
+            **contract,
+            from_date__lte=to_date + ONE_DAY,
+            to_date__gte=from_date - ONE_DAY,
+        )
+        for span in touching:
+            from_date = min(from_date, span.from_date)
+            to_date = max(to_date, span.to_date)
+            bar_count += span.bar_count
+        if touching:
+            await OptionBarCoverage.filter(id__in=[span.id for span in touching]).delete()
+        await OptionBarCoverage.create(**contract, from_date=from_date, to_date=to_date, bar_count=bar_count)
+
+    logger.debug(f"Coverage for {contract} now includes {from_date} to {to_date}")
@@ -0,0 +1,397 @@
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%d-%b-%Y"
+
+
+def _daily_actions(prev: np.ndarray, cur: np.ndarray, transacted: np.ndarray) -> np.ndarray:
+    """
+    Label the change in net lots between the start and the end of a day,
+    e.g. NEW_LONG, ADDED_TO_SHORT, FLIPPED_TO_LONG, REDUCED_SHORT, CLOSED_LONG.
+    """
+    conditions = [
+        (prev == 0) & (cur > 0),
+        (prev == 0) & (cur < 0),
+        (prev > 0) & (cur > prev),
+        (prev < 0) & (cur < prev),
+        (prev < 0) & (cur > 0),
+        (prev > 0) & (cur < 0),
+        (prev > 0) & (cur == 0),
+        (prev < 0) & (cur == 0),
+        (prev > 0) & (cur > 0) & (cur < prev),
+        (prev < 0) & (cur < 0) & (cur > prev),
+        (prev != 0) & (cur == prev) & transacted,
+    ]
+    choices = [
+        "NEW_LONG", "NEW_SHORT",
+        "ADDED_TO_LONG", "ADDED_TO_SHORT",
+        "FLIPPED_TO_LONG", "FLIPPED_TO_SHORT",
+        "CLOSED_LONG", "CLOSED_SHORT",
+        "REDUCED_LONG", "REDUCED_SHORT",
+        "MODIFIED_NO_NET_LOT_CHANGE",
+    ]
+    return np.select(conditions, choices, default="NO_CHANGE")
+
+
+def _unrealised_row(combo, entry: Dict[str, Any]) -> Dict[str, Any]:
+    closing_price = entry["closing_price"]
+    avg_entry_price = round(entry["avg_entry_price"], 2)
+    pnl_calc_str = "N/A"
+    if closing_price is not None:
+        if entry["position_type"] == "LONG":
+            pnl_calc_str = f"({closing_price} - {avg_entry_price}) * {entry['lots']} * {entry['market_lot']}"
+        elif entry["position_type"] == "SHORT":
+            pnl_calc_str = f"({avg_entry_price} - {closing_price}) * {entry['lots']} * {entry['market_lot']}"
+
+    return {
+        "contract": list(combo) + [entry["position_type"]],
+        "lots": entry["lots"],
+        "daily_action": entry["daily_action"],
+        "debug_info": {
+            "entry_price": avg_entry_price,
+            "closing_price": closing_price,
+            "market_lot": entry["market_lot"],
+            "pnl_calculation": pnl_calc_str
+        },
+        "pnl": round(entry["pnl"], 2)
+    }
+
+
+def _realised_row(combo, event: Dict[str, Any]) -> Dict[str, Any]:
+    closed_type = event["closed_position_type"]
+    entry_price, exit_price = event["entry_price"], event["exit_price"]
+    if closed_type == "LONG":  # Realized from selling a long
+        pnl_calc_str = f"({exit_price:.2f} - {entry_price:.2f}) * {event['lots']} * {event['market_lot']}"
+    else:  # Realized from buying back a short
+        pnl_calc_str = f"({entry_price:.2f} - {exit_price:.2f}) * {event['lots']} * {event['market_lot']}"
+
+    return {
+        "contract": list(combo) + [f"CLOSED_{closed_type}"],
+        "lots": event["lots"],
+        "pnl": round(event["pnl"], 2),
+        "debug_info": {
+            "entry_price_closed": round(entry_price, 2),
+            "exit_price": round(exit_price, 2),
+            "market_lot": event["market_lot"],
+            "pnl_calculation": pnl_calc_str
+        }
+    }
+
+
+def _seed_positions(initial_state: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Turn the open FIFO layers of a saved state back into opening transactions."""
+    seeds = []
+    for combo_state in (initial_state or {}).get("positions", []):
+        for price, qty in combo_state["layers"]:
+            seeds.append({
+                "symbol": combo_state["symbol"],
+                "option_type": combo_state["option_type"],
+                "strike_price": combo_state["strike_price"],
+                "expiry_date": date.fromisoformat(combo_state["expiry_date"]),
+                "lots": int(qty),
+                "entry_price": float(price),
+                "market_lot": int(combo_state["market_lot"]),
+            })
+    return seeds
+
+
+def simulate_pnl(
+    positions: List[Dict[str, Any]],
+    price_matrix,
+    sim_dates: Sequence[date],
+    realise_at_end: bool = False,
+    output_from: Optional[date] = None,
+    initial_state: Optional[Dict[str, Any]] = None,
+    with_states: bool = False
+):
+    """
+    Vectorized hybrid FIFO (realised) + average price (unrealised) P&L simulation.
+
+    Positions are held as combos x dates arrays of net lots, average entry
+    price and closing price, so the cost grows with the size of those arrays
+    rather than with nested Python loops over days and combos.
+
+    FIFO matching with netting always pairs the k-th bought lot of a contract
+    with its k-th sold lot, so realised events are found from the cumulative
+    buy/sell lot counts instead of walking deques. The average entry price of
+    the open side comes from prefix sums over the same lot sequences.
+
+    Args:
+        positions: normalized transactions (symbol, option_type, strike_price,
+            expiry_date, trade_date, lots, entry_price, market_lot) in the
+            order they were traded
+        price_matrix: PriceMatrix with the closing prices of the contracts
+        sim_dates: dates to simulate; transaction dates are always included
+        realise_at_end: realise every open position at its closing price on
+            the last simulated date (month-end simulations)
+        output_from: only report days on or after this date; the cumulative
+            realised P&L starts from here
+        initial_state: state saved by a previous run (open FIFO layers and
+            realised P&L to date) to resume from instead of replaying history
+        with_states: also return the end-of-day state for every simulated date
+
+    Returns:
+        The per-day list used as "data" by the simulation endpoints, and with
+        with_states a list of {"date", "state"} dicts as well.
+    """
+    positions = [p for p in positions if p["trade_date"] <= p["expiry_date"]]
+    seeds = _seed_positions(initial_state)
+    dates = sorted(set(sim_dates) | {p["trade_date"] for p in positions})
+    if not dates or not (positions or seeds):
+        return ([], []) if with_states else []
+
+    date_index = {d: i for i, d in enumerate(dates)}
+    date_ordinals = np.array([d.toordinal() for d in dates])
+
+    # Seeded layers come first so FIFO closes them before anything traded later
+    positions = seeds + positions
+    is_seed = np.arange(len(positions)) < len(seeds)
+
+    combo_index = {}
+    for p in positions:
+        combo_index.setdefault((p["symbol"], p["option_type"], p["strike_price"], p["expiry_date"]), len(combo_index))
+    combos = list(combo_index)
+    C, D = len(combos), len(dates)
+
+    # --- Transactions as flat arrays (ordinal = trade order) ---
+    c_idx = np.array([combo_index[(p["symbol"], p["option_type"], p["strike_price"], p["expiry_date"])] for p in positions])
+    t_idx = np.array([date_index[p["trade_date"]] if "trade_date" in p else 0 for p in positions])
+    lots = np.array([p["lots"] for p in positions], dtype=np.int64)
+    prices = np.array([p["entry_price"] for p in positions], dtype=float)
+    txn_market_lots = np.array([p["market_lot"] for p in positions], dtype=np.int64)
+
+    market_lot = np.zeros(C, dtype=np.int64)
+    market_lot[c_idx] = txn_market_lots  # last transaction wins, as before
+
+    # --- Net lots per combo x date ---
+    is_buy = lots > 0
+    buy_delta = np.zeros((C, D), dtype=np.int64)
+    sell_delta = np.zeros((C, D), dtype=np.int64)
+    txn_count = np.zeros((C, D), dtype=np.int64)
+    np.add.at(buy_delta, (c_idx[is_buy], t_idx[is_buy]), lots[is_buy])
+    np.add.at(sell_delta, (c_idx[~is_buy], t_idx[~is_buy]), -lots[~is_buy])
+    np.add.at(txn_count, (c_idx[~is_seed], t_idx[~is_seed]), 1)
+    bought = np.cumsum(buy_delta, axis=1)
+    sold = np.cumsum(sell_delta, axis=1)
+    net = bought - sold
+
+    # --- Lot sequences (one entry per lot) ordered by combo, then trade order ---
+    order = np.lexsort((np.arange(len(positions)), c_idx))
+    buy_txns = order[is_buy[order]]
+    sell_txns = order[~is_buy[order]]
+    buy_lot_txn = np.repeat(buy_txns, lots[buy_txns])
+    sell_lot_txn = np.repeat(sell_txns, -lots[sell_txns])
+    n_buy = np.bincount(c_idx[buy_lot_txn], minlength=C)
+    n_sell = np.bincount(c_idx[sell_lot_txn], minlength=C)
+    buy_offset = np.concatenate(([0], np.cumsum(n_buy)[:-1]))
+    sell_offset = np.concatenate(([0], np.cumsum(n_sell)[:-1]))
+    buy_prefix = np.concatenate(([0.0], np.cumsum(prices[buy_lot_txn])))
+    sell_prefix = np.concatenate(([0.0], np.cumsum(prices[sell_lot_txn])))
+
+    # --- Average entry price of the open side ---
+    matched = np.minimum(bought, sold)
+    open_lots = np.abs(net)
+    long_cost = buy_prefix[buy_offset[:, None] + bought] - buy_prefix[buy_offset[:, None] + matched]
+    short_cost = sell_prefix[sell_offset[:, None] + sold] - sell_prefix[sell_offset[:, None] + matched]
+    open_cost = np.where(net > 0, long_cost, short_cost)
+    avg_price = np.divide(open_cost, open_lots, out=np.zeros((C, D)), where=open_lots > 0)
+
+    # --- Expiry: an open position is settled at 0 on the first date after expiry ---
+    expiry_ordinals = np.array([combo[3].toordinal() for combo in combos])
+    expiry_at = np.searchsorted(date_ordinals, expiry_ordinals, side="right")
+    has_expiry_day = expiry_at < D
+    safe_expiry_at = np.minimum(expiry_at, D - 1)
+    rows = np.arange(C)
+    expiring = has_expiry_day & (net[rows, safe_expiry_at] != 0)
+    after_expiry = np.arange(D)[None, :] >= expiry_at[:, None]
+    net_eff = np.where(after_expiry, 0, net)
+    opening_net = np.zeros(C, dtype=np.int64)
+    np.add.at(opening_net, c_idx[is_seed], lots[is_seed])
+    prev_net = np.concatenate((opening_net[:, None], net_eff[:, :-1]), axis=1)
+
+    # --- Closing prices and unrealised P&L ---
+    closing = np.full((C, D), np.nan)
+    for c, (symbol, option_type, strike, expiry) in enumerate(combos):
+        for trade_date, price in price_matrix.series(symbol, option_type, strike, expiry).items():
+            t = date_index.get(trade_date)
+            if t is not None:
+                closing[c, t] = price
+    unrealised_pnl = (closing - avg_price) * net_eff * market_lot[:, None] + 0.0  # no -0.0 for flat shorts
+
+    txn_day = np.bincount(t_idx[~is_seed], minlength=D) > 0
+    transacted = txn_count > 0
+    priced = (net_eff != 0) & ~np.isnan(closing)
+    flat_after_txn = (net_eff == 0) & transacted & ~after_expiry
+
+    # --- Realised events ---
+    # FIFO pairs the k-th bought lot with the k-th sold lot of each combo
+    n_pairs = np.minimum(n_buy, n_sell)
+    pair_combo = np.repeat(rows, n_pairs)
+    pair_k = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+    pair_buy = buy_lot_txn[buy_offset[pair_combo] + pair_k]
+    pair_sell = sell_lot_txn[sell_offset[pair_combo] + pair_k]
+
+    events = defaultdict(list)  # date index -> [(combo index, event)]
+    if len(pair_buy):
+        starts = np.flatnonzero(np.concatenate((
+            [True], (pair_buy[1:] != pair_buy[:-1]) | (pair_sell[1:] != pair_sell[:-1])
+        )))
+        event_lots = np.diff(np.concatenate((starts, [len(pair_buy)])))
+        ev_buy, ev_sell = pair_buy[starts], pair_sell[starts]
+        ev_close = np.maximum(ev_buy, ev_sell)
+        ev_long = ev_buy < ev_sell
+        ev_pnl = (prices[ev_sell] - prices[ev_buy]) * event_lots * txn_market_lots[ev_close]
+        for i in range(len(starts)):
+            closing_txn, opening_txn = (ev_sell[i], ev_buy[i]) if ev_long[i] else (ev_buy[i], ev_sell[i])
+            events[int(t_idx[closing_txn])].append((int(pair_combo[starts[i]]), {
+                "pnl": float(ev_pnl[i]),
+                "lots": int(event_lots[i]),
+                "exit_price": float(prices[closing_txn]),
+                "entry_price": float(prices[opening_txn]),
+                "market_lot": int(txn_market_lots[closing_txn]),
+                "closed_position_type": "LONG" if ev_long[i] else "SHORT",
+            }))
+
+    for c in np.flatnonzero(expiring):
+        t = int(expiry_at[c])
+        events[t].append((int(c), {
+            "pnl": float((0 - avg_price[c, t]) * net[c, t] * market_lot[c]),
+            "lots": int(abs(net[c, t])),
+            "exit_price": 0.0,  # Assuming 0 settlement
+            "entry_price": float(avg_price[c, t]),
+            "market_lot": int(market_lot[c]),
+            "closed_position_type": "LONG" if net[c, t] > 0 else "SHORT",
+            "reason": "EXPIRY"
+        }))
+
+    month_end = np.zeros((C, D), dtype=bool)
+    if realise_at_end:
+        month_end[:, D - 1] = priced[:, D - 1]
+        for c in np.flatnonzero(month_end[:, D - 1]):
+            events[D - 1].append((int(c), {
+                "pnl": float(unrealised_pnl[c, D - 1]),
+                "lots": int(abs(net_eff[c, D - 1])),
+                "exit_price": float(closing[c, D - 1]),
+                "entry_price": float(avg_price[c, D - 1]),
+                "market_lot": int(market_lot[c]),
+                "closed_position_type": "LONG" if net_eff[c, D - 1] > 0 else "SHORT",
+                "reason": "MONTH_END_REALIZATION"
+            }))
+
+    # --- Unrealised entries, gathered as (date, combo) coordinates ---
+    expired_entry = np.zeros((C, D), dtype=bool)
+    expired_entry[np.flatnonzero(expiring), expiry_at[expiring]] = True
+    show = priced | flat_after_txn | expired_entry
+    entry_t, entry_c = np.nonzero(show.T)
+    prev_at = prev_net[entry_c, entry_t]
+    cur_at = np.where(expired_entry[entry_c, entry_t], net[entry_c, entry_t], net_eff[entry_c, entry_t])
+    actions = _daily_actions(prev_at, cur_at, transacted[entry_c, entry_t])
+
+    unrealised = defaultdict(list)
+    for i in range(len(entry_t)):
+        c, t = int(entry_c[i]), int(entry_t[i])
+        if expired_entry[c, t]:
+            entry = {
+                "pnl": 0.0, "lots": 0, "closing_price": 0.0, "avg_entry_price": 0.0,
+                "market_lot": int(market_lot[c]),
+                "position_type": "LONG" if net[c, t] > 0 else "SHORT",
+                "daily_action": "EXPIRED"
+            }
+        elif priced[c, t]:
+            entry = {
+                "pnl": float(unrealised_pnl[c, t]),
+                "lots": int(abs(net_eff[c, t])),
+                "closing_price": float(closing[c, t]),
+                "avg_entry_price": float(avg_price[c, t]),
+                "market_lot": int(market_lot[c]),
+                "position_type": "LONG" if net_eff[c, t] > 0 else "SHORT",
+                # Daily actions are only reported on transaction days
+                "daily_action": str(actions[i]) if txn_day[t] else None
+            }
+            if month_end[c, t]:
+                entry["daily_action"] = "REALIZED_AT_MONTH_END"
+        else:
+            entry = {
+                "pnl": 0.0, "lots": 0, "closing_price": None, "avg_entry_price": 0.0,
+                "market_lot": int(market_lot[c]),
+                "position_type": "FLAT",
+                "daily_action": str(actions[i])
+            }
+        unrealised[t].append((c, entry))
+
+    # --- Build response ---
+    out = []
+    cumulative_realized_pnl = 0.0
+    if output_from is None and initial_state:
+        cumulative_realized_pnl = float(initial_state.get("cumulative_realized_pnl", 0.0))
+    for t in sorted(set(unrealised) | set(events)):
+        if output_from is not None and dates[t] < output_from:
+            continue
+        day_unrealised = unrealised.get(t, [])
+        day_events = sorted(events.get(t, []), key=lambda item: item[0])
+
+        daily_unrealised_pnl_sum = sum(entry["pnl"] for _, entry in day_unrealised)
+        daily_realised_pnl_sum = sum(event["pnl"] for _, event in day_events)
+        cumulative_realized_pnl += daily_realised_pnl_sum
+
+        out.append({
+            "date": dates[t].strftime(DATE_FORMAT),
+            "unrealised": [
+                _unrealised_row(combos[c], entry) for c, entry in day_unrealised
+                if entry["closing_price"] is not None or entry["daily_action"] not in (None, "NO_CHANGE")
+            ],
+            "realised": [_realised_row(combos[c], event) for c, event in day_events if event["lots"] > 0],
+            "total_unrealised_pnl": round(daily_unrealised_pnl_sum, 2),
+            "total_realized_pnl": round(daily_realised_pnl_sum, 2),  # Daily realized
+            "cumulative_total_realized_pnl": round(cumulative_realized_pnl, 2)  # Cumulative
+        })
+
+    logger.info(f"Simulated {C} contracts over {D} dates ({len(positions)} transactions)")
+    if not with_states:
+        return out
+
+    # --- End-of-day state (open FIFO layers + realised P&L to date) per date ---
+    daily_realised = np.zeros(D)
+    for t, day_events in events.items():
+        daily_realised[t] = sum(event["pnl"] for _, event in day_events)
+    realised_to_date = np.cumsum(daily_realised)
+    if initial_state:
+        realised_to_date += float(initial_state.get("cumulative_realized_pnl", 0.0))
+
+    layer_cache = {}
+
+    def _open_layers(c, b, s):
+        # Layers only depend on how many lots were bought and sold so far
+        if (c, b, s) not in layer_cache:
+            if b > s:
+                lot_txns, sign = buy_lot_txn[buy_offset[c] + s:buy_offset[c] + b], 1
+            else:
+                lot_txns, sign = sell_lot_txn[sell_offset[c] + b:sell_offset[c] + s], -1
+            txns, counts = np.unique(lot_txns, return_counts=True)
+            layer_cache[(c, b, s)] = [[float(prices[txn]), sign * int(n)] for txn, n in zip(txns, counts)]
+        return layer_cache[(c, b, s)]
+
+    states = []
+    for t in range(D):
+        open_combos = []
+        for c in np.flatnonzero(net_eff[:, t]):
+            symbol, option_type, strike, expiry = combos[c]
+            open_combos.append({
+                "symbol": symbol,
+                "option_type": option_type,
+                "strike_price": strike,
+                "expiry_date": expiry.isoformat(),
+                "market_lot": int(market_lot[c]),
+                "layers": _open_layers(int(c), int(bought[c, t]), int(sold[c, t]))
+            })
+        states.append({
+            "date": dates[t],
+            "state": {"cumulative_realized_pnl": float(realised_to_date[t]), "positions": open_combos}
+        })
+    return out, states
@@ -0,0 +1,117 @@
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Iterable, Optional, Tuple
+
+from services.utils import execute_native_query
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the number of values bound into a single IN (...) list
+IN_CLAUSE_CHUNK_SIZE = 200
+
+
+class PriceMatrix:
+    """
+    In-memory closing prices for a set of option contracts.
+
+    Prices are keyed by contract combo (symbol, option_type, strike, expiry)
+    and then by trading date, so the simulation loops can read a price with
+    a dict lookup instead of a database round-trip per contract per day.
+    """
+
+    def __init__(self):
+        self._prices = defaultdict(dict)
+
+    @staticmethod
+    def _key(symbol, option_type, strike_price, expiry_date):
+        return (symbol.upper(), option_type.upper(), float(strike_price), expiry_date)
+
+    def add(self, symbol, option_type, strike_price, expiry_date, trade_date, closing_price):
+        self._prices[self._key(symbol, option_type, strike_price, expiry_date)][trade_date] = closing_price
+
+    def get(
+        self,
+        symbol: str,
+        target_date: date,
+        expiry_date: date,
+        option_type: str,
+        strike_price: float
+    ) -> Optional[float]:
+        """
+        Same argument order as get_closing_price, returns None when the
+        contract did not trade (or is not cached) on target_date.
+        """
+        series = self._prices.get(self._key(symbol, option_type, strike_price, expiry_date))
+        if not series:
+            return None
+        return series.get(target_date)
+
+    def series(self, symbol, option_type, strike_price, expiry_date) -> Dict[date, float]:
+        return self._prices.get(self._key(symbol, option_type, strike_price, expiry_date), {})
+
+    def __len__(self):
+        return sum(len(series) for series in self._prices.values())
+
+
+def _chunks(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+async def load_price_matrix(
+    combos: Iterable[Tuple[str, str, float, date]],
+    start_date: date,
+    end_date: date
+) -> PriceMatrix:
+    """
+    Preload closing prices for every (symbol, option_type, strike, expiry)
+    combo between start_date and end_date.
+
+    One query is issued per symbol (per chunk of expiries) against the
+    option_bars index, using IN (...) lists on expiry, option type and
+    strike. The IN lists form a cross product, so rows for combos that were
+    not requested are dropped here rather than in SQL.
+    """
+    matrix = PriceMatrix()
+
+    wanted = set()
+    by_symbol = defaultdict(lambda: defaultdict(set))  # symbol -> expiry -> {(option_type, strike)}
+    for symbol, option_type, strike_price, expiry_date in combos:
+        key = PriceMatrix._key(symbol, option_type, strike_price, expiry_date)
+        wanted.add(key)
+        by_symbol[key[0]][expiry_date].add((key[1], key[2]))
+
+    for symbol, expiries in by_symbol.items():
+        for expiry_chunk in _chunks(sorted(expiries), IN_CLAUSE_CHUNK_SIZE):
+            option_types = sorted({opt for exp in expiry_chunk for opt, _ in expiries[exp]})
+            strikes = sorted({strike for exp in expiry_chunk for _, strike in expiries[exp]})
+
+            query = f"""
+            SELECT trade_date, expiry_date, option_type, strike_price, closing_price
+            FROM option_bars
+            WHERE symbol = %s
+            AND expiry_date IN ({", ".join(["%s"] * len(expiry_chunk))})
+            AND option_type IN ({", ".join(["%s"] * len(option_types))})
+            AND strike_price IN ({", ".join(["%s"] * len(strikes))})
+            AND trade_date BETWEEN %s AND %s
+            """
+            try:
+                rows = await execute_native_query(
+                    query, [symbol] + list(expiry_chunk) + option_types + strikes + [start_date, end_date]
+                )
+            except Exception as e:
+                logger.error(f"Error preloading closing prices for {symbol}: {e}")
+                continue
+
+            for row in rows or []:
+                if row["closing_price"] is None:
+                    continue
+                key = PriceMatrix._key(symbol, row["option_type"], row["strike_price"], row["expiry_date"])
+                if key not in wanted:
+                    continue
+                matrix.add(*key, row["trade_date"], float(row["closing_price"]))
+
+    logger.info(f"Preloaded {len(matrix)} closing prices for {len(wanted)} contracts between {start_date} and {end_date}")
+    return matrix
@@ -0,0 +1,150 @@
+import bisect
+import hashlib
+import logging
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from tortoise.transactions import in_transaction
+
+from db.models.users import SimulationSnapshots
+from services.price_matrix import PriceMatrix
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionDigests:
+    """
+    Running digest of a user's transactions in trade order.
+
+    digest_on(d) identifies the exact set of transactions traded on or before
+    d, so a snapshot saved for d is still valid as long as the digests match.
+    Adding, editing or deleting a transaction changes the digest of every day
+    from its trade date onwards.
+    """
+
+    def __init__(self, positions: List[Dict[str, Any]]):
+        running = hashlib.sha256()
+        self._dates = []
+        self._digests = []
+        self._empty = running.hexdigest()
+        for p in positions:
+            running.update(repr((
+                p.get("transaction_id"), p["trade_date"].isoformat(), p["symbol"], p["option_type"],
+                p["strike_price"], p["expiry_date"].isoformat(), p["lots"], p["entry_price"], p["market_lot"]
+            )).encode())
+            if self._dates and self._dates[-1] == p["trade_date"]:
+                self._digests[-1] = running.hexdigest()
+            else:
+                self._dates.append(p["trade_date"])
+                self._digests.append(running.hexdigest())
+
+    def digest_on(self, day: date) -> str:
+        i = bisect.bisect_right(self._dates, day)
+        return self._digests[i - 1] if i else self._empty
+
+
+class PriceDigests:
+    """
+    Running digest of the closing prices a simulation reads, in date order.
+
+    digest_on(d) identifies the prices up to d of every contract traded on or
+    before d, i.e. everything the output rows up to d were computed from. A
+    price backfilled or corrected for a past day changes the digest of every
+    day from that day (or the contract's first trade, if later) onwards.
+    """
+
+    def __init__(self, positions: List[Dict[str, Any]], price_matrix: PriceMatrix):
+        first_traded = {}
+        for p in positions:
+            combo = (p["symbol"], p["option_type"], p["strike_price"], p["expiry_date"])
+            first_traded[combo] = min(first_traded.get(combo, p["trade_date"]), p["trade_date"])
+
+        # A price only counts from the day its contract is first traded
+        prices = sorted(
+            (max(trade_date, first_day), repr(combo), trade_date, price)
+            for combo, first_day in first_traded.items()
+            for trade_date, price in price_matrix.series(*combo).items()
+        )
+
+        running = hashlib.sha256()
+        self._dates = []
+        self._digests = []
+        self._empty = running.hexdigest()
+        for day, combo, trade_date, price in prices:
+            running.update(repr((combo, trade_date.isoformat(), price)).encode())
+            if self._dates and self._dates[-1] == day:
+                self._digests[-1] = running.hexdigest()
+            else:
+                self._dates.append(day)
+                self._digests.append(running.hexdigest())
+
+    def digest_on(self, day: date) -> str:
+        i = bisect.bisect_right(self._dates, day)
+        return self._digests[i - 1] if i else self._empty
+
+
+async def find_resume_point(user_id, digests: TransactionDigests, price_digests: PriceDigests) -> Optional[date]:
+    """
+    Latest snapshot date whose transaction and price digests still match, i.e.
+    the last day before the earliest changed transaction or price. None when
+    nothing is reusable.
+    """
+    rows = await SimulationSnapshots.filter(user_id=user_id).order_by("-snapshot_date").values(
+        "snapshot_date", "txn_digest", "price_digest"
+    )
+    for row in rows:
+        if (row["txn_digest"] == digests.digest_on(row["snapshot_date"])
+                and row["price_digest"] == price_digests.digest_on(row["snapshot_date"])):
+            return row["snapshot_date"]
+    return None
+
+
+async def load_snapshot(user_id, resume_date: date) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Simulation state at the end of resume_date and the stored output rows up
+    to and including it.
+    """
+    snapshot = await SimulationSnapshots.get(user_id=user_id, snapshot_date=resume_date)
+    rows = await SimulationSnapshots.filter(
+        user_id=user_id, snapshot_date__lte=resume_date, day__isnull=False
+    ).order_by("snapshot_date").only("id", "snapshot_date", "day")
+    return snapshot.state, [row.day for row in rows]
+
+
+async def save_snapshots(
+    user_id,
+    resume_date: Optional[date],
+    states: List[Dict[str, Any]],
+    out: List[Dict[str, Any]],
+    digests: TransactionDigests,
+    price_digests: PriceDigests
+):
+    """
+    Replace every snapshot after resume_date with the freshly simulated days.
+
+    Only days before today are stored: later closing prices may still be
+    missing from the cache and must not be frozen into a snapshot.
+    """
+    today = date.today()
+    rows_by_date = {row["date"]: row for row in out}
+    snapshots = [
+        SimulationSnapshots(
+            user_id=user_id,
+            snapshot_date=s["date"],
+            txn_digest=digests.digest_on(s["date"]),
+            price_digest=price_digests.digest_on(s["date"]),
+            state=s["state"],
+            day=rows_by_date.get(s["date"].strftime("%d-%b-%Y"))
+        )
+        for s in states if s["date"] < today
+    ]
+
+    async with in_transaction():
+        stale = SimulationSnapshots.filter(user_id=user_id)
+        if resume_date is not None:
+            stale = stale.filter(snapshot_date__gt=resume_date)
+        await stale.delete()
+        if snapshots:
+            await SimulationSnapshots.bulk_create(snapshots)
+
+    logger.info(f"Saved {len(snapshots)} simulation snapshots for user {user_id} after {resume_date}")
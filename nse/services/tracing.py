@@ -0,0 +1,290 @@
+"""
+Request tracing across the gateway and the services.
+
+The gateway mints a trace id for every request and sends it upstream in the
+X-Trace-Id header, with X-Parent-Span-Id naming the gateway span that made the
+call. TracingMiddleware opens a server span for each request it receives;
+code below it records db, http and compute spans with span(). Finished spans
+are kept per trace in an in-memory collector (served by routers.traces) and,
+when TRACE_EXPORT_FILE is set, appended to it as JSON lines once the request
+is done. Outside a traced request span() does nothing.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from conf import settings
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "x-trace-id"
+PARENT_SPAN_HEADER = "x-parent-span-id"
+
+# slowest spans / span names listed by summarize()
+SUMMARY_TOP = 10
+# characters of a SQL statement kept on its db span
+STATEMENT_CHARS = 160
+
+_VALID_ID = re.compile(r"^[0-9a-f]{8,64}$")
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+def _new_id(n_bytes: int) -> str:
+    return os.urandom(n_bytes).hex()
+
+
+class Span:
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "name", "kind", "service",
+        "started_at", "duration_ms", "attributes", "error", "_started",
+    )
+
+    def __init__(self, trace_id: str, parent_id: Optional[str], name: str, kind: str, attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.service = collector.service
+        self.started_at = time.time()
+        self.duration_ms = None
+        self.attributes = attributes
+        self.error = None
+        self._started = time.perf_counter()
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 3)
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "service": self.service,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class SpanCollector:
+    """Finished spans of the last TRACE_MAX_TRACES traces, oldest trace evicted first."""
+
+    def __init__(self):
+        self.service = "unknown"
+        self._traces: "OrderedDict[str, dict]" = OrderedDict()
+
+    def record(self, span: Span):
+        trace = self._traces.get(span.trace_id)
+        if trace is None:
+            trace = self._traces[span.trace_id] = {"spans": [], "dropped": 0}
+            while len(self._traces) > settings.TRACE_MAX_TRACES:
+                self._traces.popitem(last=False)
+        if len(trace["spans"]) >= settings.TRACE_MAX_SPANS_PER_TRACE:
+            trace["dropped"] += 1
+            return
+        trace["spans"].append(span)
+
+    def get(self, trace_id: str) -> Optional[dict]:
+        trace = self._traces.get(trace_id)
+        if trace is None:
+            return None
+        return {
+            "service": self.service,
+            "spans": [span.as_dict() for span in trace["spans"]],
+            "dropped": trace["dropped"],
+        }
+
+    def recent(self, limit: int) -> List[dict]:
+        """The server spans of the latest traces, newest first."""
+        requests = []
+        for trace_id in reversed(self._traces):
+            for span in self._traces[trace_id]["spans"]:
+                if span.kind == "server":
+                    requests.append({**span.as_dict(), "spans": len(self._traces[trace_id]["spans"])})
+            if len(requests) >= limit:
+                break
+        return requests[:limit]
+
+    def export(self, trace_id: str):
+        """Append the spans of a finished request to TRACE_EXPORT_FILE, if set."""
+        trace = self._traces.get(trace_id)
+        if not settings.TRACE_EXPORT_FILE or trace is None:
+            return
+        try:
+            with open(settings.TRACE_EXPORT_FILE, "a") as f:
+                for span in trace["spans"]:
+                    f.write(json.dumps(span.as_dict(), default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not export trace {trace_id}: {e}")
+
+
+collector = SpanCollector()
+
+
+def trace_headers() -> Dict[str, str]:
+    """Headers that make an outgoing request part of the current trace."""
+    current = _current_span.get()
+    if current is None:
+        return {}
+    return {TRACE_HEADER: current.trace_id, PARENT_SPAN_HEADER: current.span_id}
+
+
+def client_trace_config(propagate: bool = False) -> aiohttp.TraceConfig:
+    """
+    aiohttp hooks recording an http span per request of a ClientSession
+    (from sending it until the response headers arrive). With propagate, the
+    request carries the trace headers; only set it for calls to our services.
+    """
+    async def on_request_start(session, context, params):
+        parent = _current_span.get()
+        context.span = None
+        if parent is None:
+            return
+        context.span = Span(
+            parent.trace_id, parent.span_id, f"{params.method} {params.url.host}", "http",
+            {"url": str(params.url.with_query(None))},
+        )
+        if propagate:
+            params.headers[TRACE_HEADER] = parent.trace_id
+            params.headers[PARENT_SPAN_HEADER] = context.span.span_id
+
+    async def on_request_end(session, context, params):
+        if context.span is not None:
+            context.span.attributes["status"] = params.response.status
+            context.span.finish()
+            collector.record(context.span)
+
+    async def on_request_exception(session, context, params):
+        if context.span is not None:
+            context.span.error = f"{type(params.exception).__name__}: {params.exception}"
+            context.span.finish()
+            collector.record(context.span)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def statement_summary(query: str) -> str:
+    return " ".join(query.split())[:STATEMENT_CHARS]
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = "compute", **attributes):
+    """
+    Record the enclosed block as a child of the current span; yields the Span
+    (to add attributes) or None when no trace is active.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(parent.trace_id, parent.span_id, name, kind, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        collector.record(current)
+
+
+def summarize(spans: List[dict]) -> dict:
+    """
+    Where the time of one trace went: server time per service, total time and
+    count per span kind and per span name, and the slowest spans. Spans nest
+    (a compute phase contains its queries), so the totals overlap.
+    """
+    server_ms, kinds, names = {}, {}, {}
+    for item in spans:
+        duration = item["duration_ms"] or 0.0
+        if item["kind"] == "server":
+            server_ms[item["service"]] = round(server_ms.get(item["service"], 0.0) + duration, 3)
+            continue
+        for totals, key in ((kinds, item["kind"]), (names, f"{item['service']}:{item['name']}")):
+            total = totals.setdefault(key, {"count": 0, "total_ms": 0.0})
+            total["count"] += 1
+            total["total_ms"] = round(total["total_ms"] + duration, 3)
+
+    def by_time(entry):
+        return -entry[1]["total_ms"]
+
+    inner_spans = [item for item in spans if item["kind"] != "server"]
+    return {
+        "spans": len(spans),
+        "server_ms": server_ms,
+        "kinds": dict(sorted(kinds.items(), key=by_time)),
+        "names": dict(sorted(names.items(), key=by_time)[:SUMMARY_TOP]),
+        "slowest": sorted(inner_spans, key=lambda item: -(item["duration_ms"] or 0.0))[:SUMMARY_TOP],
+        "errors": [item for item in spans if item["error"]],
+    }
+
+
+def _header_id(headers: dict, name: str) -> Optional[str]:
+    value = headers.get(name.encode("latin-1"), b"").decode("latin-1").lower()
+    return value if _VALID_ID.match(value) else None
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening the server span of every HTTP request, joined to
+    the caller's trace when it sent X-Trace-Id. Answers carry X-Trace-Id so
+    the trace of any response can be looked up.
+    """
+
+    def __init__(self, app, service: str, exclude: tuple = ()):
+        self.app = app
+        self.exclude = exclude
+        collector.service = service
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not settings.TRACING_ENABLED
+                or scope["path"].startswith(self.exclude)):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        trace_id = _header_id(headers, TRACE_HEADER) or _new_id(16)
+        root = Span(
+            trace_id, _header_id(headers, PARENT_SPAN_HEADER),
+            f"{scope['method']} {scope['path']}", "server", {},
+        )
+
+        async def send_with_trace_id(message):
+            if message["type"] == "http.response.start":
+                root.attributes["status"] = message["status"]
+                response_headers = list(message.get("headers", []))
+                if not any(name.lower() == TRACE_HEADER.encode() for name, _ in response_headers):
+                    response_headers.append((TRACE_HEADER.encode(), trace_id.encode()))
+                message = {**message, "headers": response_headers}
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            root.finish()
+            collector.record(root)
+            collector.export(trace_id)
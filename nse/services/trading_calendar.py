@@ -0,0 +1,131 @@
+import bisect
+import calendar
+import csv
+import logging
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from conf import settings
+
+logger = logging.getLogger(__name__)
+
+THURSDAY = 3
+
+
+def _as_date(day) -> date:
+    # Accept date, datetime and pandas Timestamp alike
+    return day.date() if isinstance(day, datetime) else day
+
+
+class TradingCalendar:
+    """
+    NSE trading days: Monday to Friday, minus exchange holidays, plus the
+    occasional special weekend session (e.g. Union Budget Saturdays).
+
+    Trading days are materialised per year as a sorted list on first use, so
+    next/previous/between lookups are a bisect rather than a day-by-day walk.
+    Years outside those the holiday list covers are treated as weekdays only,
+    with a warning the first time each one is used.
+    """
+
+    def __init__(self, holidays: Iterable[date] = (), special_sessions: Iterable[date] = ()):
+        self.holidays = frozenset(holidays)
+        self.special_sessions = frozenset(special_sessions)
+        self.covered_years = frozenset(day.year for day in self.holidays | self.special_sessions)
+        self._years: Dict[int, List[date]] = {}
+
+    @classmethod
+    def from_file(cls, path: str) -> "TradingCalendar":
+        """
+        Load a CSV with columns date (YYYY-MM-DD), type (HOLIDAY or TRADING)
+        and description. A missing file gives a weekday-only calendar.
+        """
+        holidays, special_sessions = [], []
+        try:
+            with open(path, newline="") as f:
+                for row in csv.DictReader(f):
+                    day = datetime.strptime(row["date"].strip(), "%Y-%m-%d").date()
+                    if row.get("type", "HOLIDAY").strip().upper() == "TRADING":
+                        special_sessions.append(day)
+                    else:
+                        holidays.append(day)
+        except FileNotFoundError:
+            logger.warning(f"Trading holiday file {path} not found, only weekends will be skipped")
+        logger.info(f"Loaded {len(holidays)} holidays and {len(special_sessions)} special sessions from {path}")
+        return cls(holidays, special_sessions)
+
+    def is_trading_day(self, day) -> bool:
+        day = _as_date(day)
+        if day in self.special_sessions:
+            return True
+        return day.weekday() < 5 and day not in self.holidays
+
+    def _year(self, year: int) -> List[date]:
+        days = self._years.get(year)
+        if days is None:
+            if self.covered_years and year not in self.covered_years:
+                logger.warning(
+                    f"No NSE holidays listed for {year} (holiday list covers "
+                    f"{min(self.covered_years)}-{max(self.covered_years)}), only weekends will be skipped"
+                )
+            first = date(year, 1, 1)
+            days = [
+                first + timedelta(days=i)
+                for i in range((date(year + 1, 1, 1) - first).days)
+                if self.is_trading_day(first + timedelta(days=i))
+            ]
+            self._years[year] = days
+        return days
+
+    def next_trading_day(self, day) -> date:
+        """First trading day strictly after day."""
+        day = _as_date(day)
+        year = day.year
+        days = self._year(year)
+        i = bisect.bisect_right(days, day)
+        while i == len(days):
+            year += 1
+            days, i = self._year(year), 0
+        return days[i]
+
+    def previous_trading_day(self, day) -> date:
+        """Last trading day strictly before day."""
+        day = _as_date(day)
+        year = day.year
+        days = self._year(year)
+        i = bisect.bisect_left(days, day)
+        while i == 0:
+            year -= 1
+            days = self._year(year)
+            i = len(days)
+        return days[i - 1]
+
+    def trading_days_between(self, start, end) -> List[date]:
+        """Trading days from start to end, both inclusive."""
+        start, end = _as_date(start), _as_date(end)
+        result = []
+        for year in range(start.year, end.year + 1):
+            days = self._year(year)
+            lo = bisect.bisect_left(days, start) if year == start.year else 0
+            hi = bisect.bisect_right(days, end) if year == end.year else len(days)
+            result.extend(days[lo:hi])
+        return result
+
+    def expiry_date(self, year: int, month: int, weekday: int = THURSDAY) -> date:
+        """
+        Monthly expiry: the last given weekday of the month, moved back to the
+        previous trading day when the exchange is closed that day.
+        """
+        expiry = date(year, month, calendar.monthrange(year, month)[1])
+        while expiry.weekday() != weekday:
+            expiry -= timedelta(days=1)
+        if not self.is_trading_day(expiry):
+            expiry = self.previous_trading_day(expiry)
+        return expiry
+
+
+@lru_cache(maxsize=None)
+def get_trading_calendar(path: Optional[str] = None) -> TradingCalendar:
+    """Process-wide calendar loaded from settings.TRADING_HOLIDAYS_FILE."""
+    return TradingCalendar.from_file(path or settings.TRADING_HOLIDAYS_FILE)
@@ -1,6 +1,7 @@
 from fastapi import HTTPException, status, Request, Response, Header
 from db.models.users import Users, UserTransactions
 from services.nse_service import get_option_data_with_cache
+from services.jobs import report_progress
 from datetime import datetime
 import asyncio
 import logging
@@ -158,6 +159,7 @@ async def create_transactions_batch_concurrent(
         batch_num = i // batch_size + 1
         
         logger.info(f"Processing batch {batch_num}: {len(batch)} transactions")
+        await report_progress(100 * i / len(option_payloads), f"Transactions batch {batch_num}")
         
         # Create TransactionCreate objects for this batch
         transaction_payloads = []
@@ -3,6 +3,8 @@ from tortoise.transactions import in_transaction
 import logging
 from fastapi import HTTPException
 
+from services.tracing import span, statement_summary
+
 # Configure Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -11,29 +13,69 @@ async def execute_native_query(query: str , params: None):
 
     connection = Tortoise.get_connection('default')
 
-    async with in_transaction():
-        results = await connection.execute_query_dict(query, params)
+    with span("db.query", "db") as current:
+        async with in_transaction():
+            results = await connection.execute_query_dict(query, params)
+        if current is not None:
+            current.attributes.update(statement=statement_summary(query), rows=len(results))
     return results    
 
 
 
 
+# Rows per multi-row INSERT statement, keeps each statement well below max_allowed_packet
+BULK_INSERT_CHUNK_SIZE = 500
+
+
+async def bulk_upsert(table_name: str, rows: list, unique_key=(), update_columns=None,
+                      chunk_size: int = BULK_INSERT_CHUNK_SIZE, keep_existing_on_null: bool = False) -> int:
+    """
+    Writes rows with multi-row INSERT statements, all inside one transaction.
+
+    With a unique_key, rows are first deduplicated on it (last one wins) and the
+    statement becomes INSERT ... ON DUPLICATE KEY UPDATE, refreshing
+    update_columns (default: every non-key column) on rows that already exist.
+    With keep_existing_on_null, a None in an incoming row leaves the stored
+    value of that column as it is instead of overwriting it with NULL.
+    Returns the number of rows sent to the database.
+    """
+    if not rows:
+        return 0
+    if unique_key:
+        rows = list({tuple(row.get(k) for k in unique_key): row for row in rows}.values())
+
+    columns = list(rows[0].keys())
+    row_placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    upsert_clause = ""
+    if unique_key:
+        if update_columns is None:
+            update_columns = [c for c in columns if c not in unique_key]
+        template = "{0} = COALESCE(VALUES({0}), {0})" if keep_existing_on_null else "{0} = VALUES({0})"
+        assignments = [template.format(c) for c in update_columns] or [f"{unique_key[0]} = {unique_key[0]}"]
+        upsert_clause = " ON DUPLICATE KEY UPDATE " + ", ".join(assignments)
+
+    with span("db.bulk_upsert", "db", table=table_name, rows=len(rows)):
+        async with in_transaction() as connection:
+            for start in range(0, len(rows), chunk_size):
+                chunk = rows[start:start + chunk_size]
+                query = (
+                    f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES "
+                    + ", ".join([row_placeholders] * len(chunk))
+                    + upsert_clause
+                )
+                values = [row.get(c) for row in chunk for c in columns]
+                await connection.execute_query(query, values)
+
+    logger.info(f"Wrote {len(rows)} rows into {table_name} in {-(-len(rows) // chunk_size)} statement(s)")
+    return len(rows)
+
+
 async def insert_into_table(table_name: str, data: list):
     """
     Inserts new data into the appropriate table.
     """
     try:
-        connection = Tortoise.get_connection("default")
-        async with in_transaction(connection):
-            for row in data:
-                columns = ", ".join(row.keys())
-                placeholders = ", ".join(["%s"] * len(row))
-                values = list(row.values())
-
-                query = f"INSERT INTO {table_name} ({columns}) VALUES ({placeholders})"
-                logger.info(f"Inserting into {table_name}: {query} with values: {values}")
-                await connection.execute_query(query, values)
-
+        await bulk_upsert(table_name, data)
         logger.info(f"✅ Successfully inserted data into {table_name}")
     except Exception as e:
         logger.exception(f"❌ Failed to insert data: {e}")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Simple test script for the NSE F&O bhavcopy parser (nse/services/bhavcopy.py),
+on a small sample of each published layout.
+"""
+import os
+import sys
+from datetime import date
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "nse"))
+
+from services.bhavcopy import parse_bhavcopy_rows  # noqa: E402
+
+LEGACY_CSV = """\
+INSTRUMENT,SYMBOL,EXPIRY_DT,STRIKE_PR,OPTION_TYP,OPEN,HIGH,LOW,CLOSE,SETTLE_PR,CONTRACTS,VAL_INLAKH,OPEN_INT,CHG_IN_OI,TIMESTAMP,
+FUTIDX,NIFTY,27-Mar-2025,0,XX,22150,22300,22100,22250,22250,1000,16000,500000,1000,03-MAR-2025,
+OPTIDX,NIFTY,06-Mar-2025,22000,CE,120.5,150,100,130.25,130.25,5000,825.5,120000,-3000,03-MAR-2025,
+OPTIDX,NIFTY,06-Mar-2025,22000,PE,80,95,60,70.1,70.1,4000,650,110000,2500,03-MAR-2025,
+OPTIDX,FINNIFTY,27-Mar-2025,23000,CE,200,210,190,205,205,10,1.2,3000,0,03-MAR-2025,
+OPTSTK,RELIANCE,27-Mar-2025,1200,CE,30,35,28,33,33,100,9,40000,200,03-MAR-2025,
+"""
+
+UDIFF_CSV = """\
+TradDt,BizDt,Sgmt,Src,FinInstrmTp,FinInstrmId,ISIN,TckrSymb,SctySrs,XpryDt,FininstrmActlXpryDt,StrkPric,OptnTp,FinInstrmNm,OpnPric,HghPric,LwPric,ClsPric,LastPric,PrvsClsgPric,UndrlygPric,SttlmPric,OpnIntrst,ChngInOpnIntrst,TtlTradgVol,TtlTrfVal,TtlNbOfTxsExctd,SsnId,NewBrdLotQty,Rmks,Rsvd1,Rsvd2,Rsvd3,Rsvd4
+2025-03-03,2025-03-03,FO,NSE,IDF,35001,,NIFTY,,2025-03-27,2025-03-27,,,NIFTY25MARFUT,22150,22300,22100,22250,22255,22120,22119.3,22250,500000,1000,75000,1660000000,9000,F1,75,,,,,
+2025-03-03,2025-03-03,FO,NSE,IDO,42001,,NIFTY,,2025-03-06,2025-03-06,22000,CE,NIFTY2530622000CE,120.5,150,100,130.25,131,118.4,22119.3,130.25,120000,-3000,375000,48900000,2200,F1,75,,,,,
+2025-03-03,2025-03-03,FO,NSE,IDO,42002,,BANKNIFTY,,2025-03-27,2025-03-27,48000,PE,BANKNIFTY25MAR48000PE,410,455,380,400,401,430,48344.7,400,25000,600,90000,36000000,1500,F1,30,,,,,
+2025-03-03,2025-03-03,FO,NSE,STO,43001,,RELIANCE,,2025-03-27,2025-03-27,1200,CE,RELIANCE25MAR1200CE,30,35,28,33,33,31,1187.2,33,40000,200,50000,1650000,300,F1,500,,,,,
+"""
+
+
+def _parse(text, symbols):
+    return list(parse_bhavcopy_rows(text.splitlines(keepends=True), symbols, source="sample"))
+
+
+def test_legacy_keeps_index_options_of_requested_symbols():
+    bars = _parse(LEGACY_CSV, ["nifty", "BANKNIFTY"])
+    # Futures, stock options and FINNIFTY (not requested) are dropped
+    assert [(bar["symbol"], bar["option_type"]) for bar in bars] == [("NIFTY", "CE"), ("NIFTY", "PE")]
+
+
+def test_legacy_row_to_bar():
+    bar = _parse(LEGACY_CSV, ["NIFTY"])[0]
+    assert bar["trade_date"] == date(2025, 3, 3)
+    assert bar["expiry_date"] == date(2025, 3, 6)
+    assert bar["strike_price"] == Decimal("22000")
+    assert bar["instrument"] == "OPTIDX"
+    assert bar["open_price"] == Decimal("120.5")
+    assert bar["closing_price"] == Decimal("130.25")
+    assert bar["settle_price"] == Decimal("130.25")
+    assert bar["traded_value"] == Decimal("825.5") * 100000
+    assert bar["open_int"] == 120000
+    assert bar["change_in_oi"] == -3000
+    # Columns the legacy layout does not carry
+    for column in ("market_lot", "last_traded_price", "prev_close", "underlying_value", "traded_qty", "market_type"):
+        assert bar[column] is None
+
+
+def test_udiff_keeps_index_options_of_requested_symbols():
+    bars = _parse(UDIFF_CSV, ["NIFTY", "BANKNIFTY"])
+    assert [(bar["symbol"], bar["option_type"]) for bar in bars] == [("NIFTY", "CE"), ("BANKNIFTY", "PE")]
+    assert _parse(UDIFF_CSV, ["FINNIFTY"]) == []
+
+
+def test_udiff_row_to_bar():
+    bar = _parse(UDIFF_CSV, ["BANKNIFTY"])[0]
+    assert bar["trade_date"] == date(2025, 3, 3)
+    assert bar["expiry_date"] == date(2025, 3, 27)
+    assert bar["strike_price"] == Decimal("48000")
+    assert bar["instrument"] == "OPTIDX"
+    assert bar["closing_price"] == Decimal("400")
+    assert bar["last_traded_price"] == Decimal("401")
+    assert bar["prev_close"] == Decimal("430")
+    assert bar["underlying_value"] == Decimal("48344.7")
+    assert bar["settle_price"] == Decimal("400")
+    assert bar["traded_value"] == Decimal("36000000")
+    assert bar["market_lot"] == 30
+    assert bar["open_int"] == 25000
+    assert bar["change_in_oi"] == 600
+    assert bar["traded_qty"] == 90000
+
+
+def test_unknown_layout_is_skipped():
+    assert _parse("SYMBOL,SERIES,OPEN\nNIFTY,EQ,1\n", ["NIFTY"]) == []
+
+
+# Test cases
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
+    print("All tests completed!")
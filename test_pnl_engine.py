@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Simple test script for the vectorized P&L engine (nse/services/pnl_engine.py):
+FIFO partial closes, a flip, expiry settlement, month-end realisation and
+resuming from a saved state, on a small hand-checked book.
+"""
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "nse"))
+
+from services.pnl_engine import simulate_pnl  # noqa: E402
+
+CE = ("NIFTY", "CE", 22000, date(2026, 3, 26))
+PE = ("NIFTY", "PE", 21000, date(2026, 3, 4))
+DAYS = [date(2026, 3, 2), date(2026, 3, 3), date(2026, 3, 4), date(2026, 3, 5), date(2026, 3, 6)]
+LOT = 50
+
+
+class Prices:
+    """The PriceMatrix.series() interface over a plain dict."""
+
+    def __init__(self, closes):
+        self.closes = closes
+
+    def series(self, symbol, option_type, strike_price, expiry_date):
+        return self.closes.get((symbol, option_type, strike_price, expiry_date), {})
+
+
+PRICES = Prices({
+    CE: dict(zip(DAYS, [102.0, 112.0, 118.0, 95.0, 80.0])),
+    PE: dict(zip(DAYS[:3], [38.0, 35.0, 30.0])),
+})
+
+
+def _txn(combo, day, lots, price):
+    symbol, option_type, strike, expiry = combo
+    return {
+        "symbol": symbol, "option_type": option_type, "strike_price": strike, "expiry_date": expiry,
+        "trade_date": day, "lots": lots, "entry_price": price, "market_lot": LOT,
+    }
+
+
+BOOK = [
+    _txn(CE, DAYS[0], 3, 100.0),
+    _txn(PE, DAYS[0], -1, 40.0),
+    _txn(CE, DAYS[1], 2, 110.0),
+    _txn(CE, DAYS[2], -4, 120.0),  # closes 3 @100 and 1 of the 2 @110
+    _txn(CE, DAYS[3], -3, 90.0),   # closes the last @110 and flips to 2 short @90
+]
+
+
+def _by_date(out):
+    return {day["date"]: day for day in out}
+
+
+def _realised(day):
+    return [(row["contract"][-1], row["lots"], row["pnl"]) for row in day["realised"]]
+
+
+def test_fifo_partial_close():
+    day = _by_date(simulate_pnl(BOOK, PRICES, DAYS))["04-Mar-2026"]
+    # (120 - 100) * 3 * 50 and (120 - 110) * 1 * 50
+    assert _realised(day) == [("CLOSED_LONG", 3, 3000.0), ("CLOSED_LONG", 1, 500.0)]
+    ce_row = [row for row in day["unrealised"] if row["contract"][1] == "CE"][0]
+    assert ce_row["lots"] == 1 and ce_row["debug_info"]["entry_price"] == 110.0
+    assert ce_row["pnl"] == (118.0 - 110.0) * 1 * LOT
+
+
+def test_flip_and_expiry_settlement():
+    day = _by_date(simulate_pnl(BOOK, PRICES, DAYS))["05-Mar-2026"]
+    # the last long lot closes at a loss, the PE short expired worthless the day before
+    assert sorted(_realised(day)) == [("CLOSED_LONG", 1, -1000.0), ("CLOSED_SHORT", 1, 2000.0)]
+    ce_row = [row for row in day["unrealised"] if row["contract"][1] == "CE"][0]
+    assert ce_row["contract"][-1] == "SHORT" and ce_row["lots"] == 2
+    assert ce_row["daily_action"] == "FLIPPED_TO_SHORT"
+    assert ce_row["pnl"] == (90.0 - 95.0) * 2 * LOT
+    assert day["cumulative_total_realized_pnl"] == 3000.0 + 500.0 - 1000.0 + 2000.0
+
+
+def test_realise_at_end():
+    out = simulate_pnl(BOOK, PRICES, DAYS, realise_at_end=True)
+    last = out[-1]
+    assert last["date"] == "06-Mar-2026"
+    # the 2 short @90 are bought back at the 80 close
+    assert _realised(last) == [("CLOSED_SHORT", 2, 1000.0)]
+    assert last["unrealised"][0]["daily_action"] == "REALIZED_AT_MONTH_END"
+    assert last["cumulative_total_realized_pnl"] == 5500.0
+
+
+def test_resume_matches_full_replay():
+    full, states = simulate_pnl(BOOK, PRICES, DAYS, with_states=True)
+    resume_day = DAYS[2]
+    state = [s["state"] for s in states if s["date"] == resume_day][0]
+    rest = simulate_pnl(
+        [p for p in BOOK if p["trade_date"] > resume_day], PRICES, DAYS[3:], initial_state=state
+    )
+    assert rest == full[3:]
+
+
+# Test cases
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name}: ok")
+    print("All tests completed!")